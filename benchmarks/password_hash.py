@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from pie.auth.hashing import Hasher, _verify
+
+TICK = 0.001
+
+
+async def measure_lag(stop: asyncio.Event):
+    worst = 0
+    total = 0
+    ticks = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lag = time.perf_counter() - start - TICK
+        worst = max(worst, lag)
+        total += lag
+        ticks += 1
+    return worst, total / max(ticks, 1)
+
+
+async def run(name, verify, hash_, logins, concurrency):
+    stop = asyncio.Event()
+    lag = asyncio.ensure_future(measure_lag(stop))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with sem:
+            assert await verify(hash_, 'password')
+
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst, mean = await lag
+    print(f'{name:<10}{logins / elapsed:>10.1f} logins/s'
+          f'{mean * 1000:>10.2f} ms mean lag{worst * 1000:>10.2f} ms max lag')
+
+
+async def main(logins=64, concurrency=16):
+    hasher = Hasher(memory_cost=65536, time_cost=3, parallelism=4)
+    try:
+        hash_ = await hasher.hash('password')
+
+        async def inline(h, password):
+            return _verify(h, password)
+
+        await run('inline', inline, hash_, logins, concurrency)
+        await run('executor', hasher.verify, hash_, logins, concurrency)
+    finally:
+        hasher.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,31 @@
+import timeit
+from datetime import datetime, timezone
+
+from pie.session.codec import decode_value, encode_value
+
+SAMPLES = {
+    'bytes': b'\x00' * 32,
+    'str': 'user@example.com',
+    'int': 1234567890,
+    'float': 3.14159,
+    'bool': True,
+    'none': None,
+    'datetime': datetime.now(timezone.utc),
+    'dict': dict(id=1, roles=['admin', 'user'], name='PIE'),
+    'large-list': [dict(id=i, title=f'item {i}') for i in range(200)],
+}
+
+
+def main(number=20000):
+    print(f'{"type":<12}{"bytes":>8}{"encode us":>12}{"decode us":>12}')
+    for name, value in SAMPLES.items():
+        data = encode_value(value)
+        assert decode_value(data) == value
+        encode = timeit.timeit(lambda: encode_value(value), number=number)
+        decode = timeit.timeit(lambda: decode_value(data), number=number)
+        print(f'{name:<12}{len(data):>8}'
+              f'{encode / number * 1e6:>12.2f}{decode / number * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+import time
+
+from pie.auth.models import Token
+from pie.db import db
+
+
+async def verify_and_use(token):
+    async with db.transaction():
+        rv = await Token.verify(token)
+        if rv is not None:
+            await rv.use()
+        return rv
+
+
+async def consume(token):
+    return await Token.consume(token)
+
+
+async def bench(name, flow, count, concurrency):
+    tokens = [await Token.new(email='bench@example.com',
+                              action=Token.Actions.login)
+              for _ in range(count)]
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(token):
+        async with sem:
+            assert await flow(token) is not None
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run(token) for token in tokens])
+    elapsed = time.perf_counter() - start
+    print(f'{name:<16}{count / elapsed:>10.1f} tokens/s'
+          f'{elapsed / count * 1000:>10.3f} ms/token')
+
+
+async def main(dsn, count=2000, concurrency=20):
+    await db.set_bind(dsn, min_size=concurrency, max_size=concurrency)
+    try:
+        await bench('verify + use', verify_and_use, count, concurrency)
+        await bench('consume', consume, count, concurrency)
+    finally:
+        await Token.delete.where(
+            Token.profile['email'].astext == 'bench@example.com',
+        ).gino.status()
+        await db.pop_bind().close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main(
+        sys.argv[1] if len(sys.argv) > 1 else
+        os.environ.get('DB_DSN', 'postgresql://localhost/pie')))
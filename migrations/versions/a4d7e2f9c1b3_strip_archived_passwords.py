@@ -0,0 +1,23 @@
+"""strip archived password hashes
+
+Revision ID: a4d7e2f9c1b3
+Revises: f2b8d6c3a4e1
+Create Date: 2026-10-18 23:02:41.527310
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e2f9c1b3'
+down_revision = 'f2b8d6c3a4e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE tokens_archive SET profile = profile - 'password' "
+               "WHERE profile ? 'password'")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,40 @@
+"""token retention
+
+Revision ID: c3f9d2a1e7b4
+Revises: b96aeefbf221
+Create Date: 2026-10-18 10:12:41.385127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9d2a1e7b4'
+down_revision = 'b96aeefbf221'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_tokens_expires_at'), 'tokens', ['expires_at'],
+                    unique=False)
+    op.create_table(
+        'tokens_archive',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('selector', sa.Unicode(), nullable=False),
+        sa.Column('validator', sa.Unicode(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('used_at', sa.DateTime(), nullable=True),
+        sa.Column('profile', postgresql.JSONB(astext_type=sa.Text()),
+                  server_default='{}', nullable=False),
+        sa.Column('archived_at', sa.DateTime(), server_default=sa.text('now()'),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('tokens_archive')
+    op.drop_index(op.f('ix_tokens_expires_at'), table_name='tokens')
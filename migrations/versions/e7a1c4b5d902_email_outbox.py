@@ -0,0 +1,43 @@
+"""email outbox
+
+Revision ID: e7a1c4b5d902
+Revises: c3f9d2a1e7b4
+Create Date: 2026-10-18 11:03:17.052946
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c4b5d902'
+down_revision = 'c3f9d2a1e7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('to_address', sa.Unicode(), nullable=False),
+        sa.Column('subject', sa.Unicode(), nullable=False),
+        sa.Column('text', sa.Unicode(), server_default='', nullable=False),
+        sa.Column('html', sa.Unicode(), server_default='', nullable=False),
+        sa.Column('status', sa.Unicode(), server_default='pending',
+                  nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0',
+                  nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Unicode(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_email_outbox_next_attempt_at'), 'email_outbox',
+                    ['next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_email_outbox_next_attempt_at'),
+                  table_name='email_outbox')
+    op.drop_table('email_outbox')
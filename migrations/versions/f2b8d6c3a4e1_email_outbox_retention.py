@@ -0,0 +1,26 @@
+"""email outbox retention
+
+Revision ID: f2b8d6c3a4e1
+Revises: e7a1c4b5d902
+Create Date: 2026-10-18 21:14:08.316550
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d6c3a4e1'
+down_revision = 'e7a1c4b5d902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_email_outbox_created_at'), 'email_outbox',
+                    ['created_at'], unique=False)
+    op.execute("UPDATE email_outbox SET text = '', html = '' "
+               "WHERE status <> 'pending'")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_email_outbox_created_at'),
+                  table_name='email_outbox')
@@ -4,7 +4,17 @@ bp = sanic.Blueprint('auth', url_prefix='auth')
 
 
 def init_app(app: sanic.Sanic):
+    from . import cache
     from . import email
+    from . import gate
+    from . import password
+    from . import retention
+    from . import store
     from . import token
 
+    cache.init_app(app)
+    gate.init_app(app)
+    password.init_app(app)
+    retention.init_app(app)
+    store.init_app(app)
     app.blueprint(bp)
@@ -0,0 +1,209 @@
+import asyncio
+import json
+
+import sanic
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from ..circuit import CircuitOpenError
+from ..db import PRIMARY, db, reads_from
+from ..metrics import registry
+from ..redis.aioredis import Script, breaker, get_redis
+from ..utils import LRUCache
+from .models import User, user_hooks
+
+_missing = object()
+# cached rows never carry the password hash
+_COLUMNS = [c.name for c in User.__table__.columns if c.name != 'password']
+
+_fill = Script('_fill_user_cache', '''\
+if ((redis.call('HGET', KEYS[1], 'gen') or '') ~= ARGV[1])
+then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'row', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+''')
+
+_bump = Script('_bump_user_cache', '''\
+redis.call('HDEL', KEYS[1], 'row')
+redis.call('HINCRBY', KEYS[1], 'gen', 1)
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+return 1
+''')
+
+
+def _count(kind, tier, hits, misses):
+    if hits:
+        registry.inc('user_cache_requests_total', hits,
+                     kind=kind, tier=tier, result='hit')
+    if misses:
+        registry.inc('user_cache_requests_total', misses,
+                     kind=kind, tier=tier, result='miss')
+
+
+class UserCache:
+    prefix = 'PIE_USER'
+
+    def __init__(self, app: sanic.Sanic, maxsize=4096, ttl=5,
+                 redis_ttl=3600):
+        self._app = app
+        self._users = LRUCache(maxsize, ttl)
+        self._emails = LRUCache(maxsize, ttl)
+        self._invalidations = 0
+        self.redis_ttl = redis_ttl
+
+    def _key(self, uid):
+        return f'{self.prefix}:{uid}'
+
+    def _email_key(self, email):
+        return f'{self.prefix}_EMAIL:{email}'
+
+    @staticmethod
+    def _dump(user):
+        return json.dumps({name: getattr(user, name) for name in _COLUMNS})
+
+    @staticmethod
+    def _load(data):
+        # every caller gets its own instance, cached data is never shared
+        if data is None:
+            return None
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return User(**json.loads(data))
+
+    @breaker
+    async def _read(self, keys):
+        # the generation guards fills against concurrent invalidations
+        return dict(zip(keys, await asyncio.gather(
+            *[get_redis(self._app, key).hmget(key, 'row', 'gen')
+              for key in keys])))
+
+    async def _try(self, coro, default=None):
+        # the Redis tier is an optimization, Postgres stays authoritative
+        try:
+            return await coro
+        except (CircuitOpenError,) + breaker.errors:
+            return default
+
+    def peek(self, uid, default=None):
+        rv = self._users.get(uid, _missing)
+        if rv is _missing:
+            return default
+        _count('id', 'local', 1, 0)
+        return self._load(rv)
+
+    async def get(self, uid):
+        return (await self.get_many([uid])).get(uid)
+
+    async def get_many(self, ids):
+        rv = {}
+        missing = []
+        for uid in ids:
+            data = self._users.get(uid, _missing)
+            if data is _missing:
+                missing.append(uid)
+            else:
+                rv[uid] = self._load(data)
+        _count('id', 'local', len(rv), len(missing))
+        if not missing:
+            return rv
+
+        invalidations = self._invalidations
+        cached = await self._try(
+            self._read([self._key(uid) for uid in missing]), {})
+        rows = {}
+        gens = {}
+        for uid in missing:
+            row, gen = cached.get(self._key(uid)) or (None, None)
+            if row is not None:
+                rows[uid] = row.decode('utf-8')
+            gens[uid] = (gen or b'').decode('utf-8')
+        _count('id', 'redis', len(rows), len(missing) - len(rows))
+
+        ids = [uid for uid in missing if uid not in rows]
+        if ids:
+            # a lagging replica would repopulate rows that were just
+            # invalidated, so fill from the primary
+            with reads_from(PRIMARY):
+                fetched = await User.query.where(
+                    User.id == any_(bindparam(
+                        'ids', ids, type_=ARRAY(db.BigInteger())))
+                ).gino.all()
+            for user in fetched:
+                rows[user.id] = data = self._dump(user)
+                key = self._key(user.id)
+                await self._try(_fill(get_redis(self._app, key), [key], [
+                    gens[user.id], data, int(self.redis_ttl * 1000)]))
+
+        for uid in missing:
+            data = rows.get(uid)
+            if invalidations == self._invalidations:
+                # unknown ids are remembered locally only, and briefly
+                self._users.set(uid, data)
+            rv[uid] = self._load(data)
+        return rv
+
+    async def get_by_email(self, email):
+        uid = self._emails.get(email)
+        if uid is not None:
+            tier = 'local'
+        else:
+            _count('email', 'local', 0, 1)
+            tier = 'redis'
+            uid = await self._try(self._get(self._email_key(email)))
+        if uid is not None:
+            user = await self.get(int(uid))
+            # the mapping may predate an email change
+            if user is not None and user.email == email:
+                _count('email', tier, 1, 0)
+                self._emails.set(email, user.id)
+                return user
+        _count('email', tier, 0, 1)
+
+        invalidations = self._invalidations
+        with reads_from(PRIMARY):
+            user = await User.query.where(User.email == email).gino.first()
+        if user is None:
+            return None
+        await self._try(self._set(self._email_key(email), str(user.id)))
+        if invalidations == self._invalidations:
+            self._emails.set(email, user.id)
+        return self._load(self._dump(user))
+
+    @breaker
+    async def _get(self, key):
+        return await get_redis(self._app, key).get(key)
+
+    @breaker
+    async def _set(self, key, value):
+        await get_redis(self._app, key).set(key, value,
+                                            expire=self.redis_ttl)
+
+    @breaker
+    async def _delete(self, *keys):
+        for key in keys:
+            await get_redis(self._app, key).delete(key)
+
+    async def invalidate(self, uid, *emails):
+        self._invalidations += 1
+        self._users.pop(uid)
+        key = self._key(uid)
+        await self._try(_bump(get_redis(self._app, key), [key],
+                              [int(self.redis_ttl * 1000)]))
+        keys = []
+        for email in emails:
+            if email:
+                self._emails.pop(email)
+                keys.append(self._email_key(email))
+        await self._try(self._delete(*keys))
+
+
+def init_app(app: sanic.Sanic):
+    app.user_cache = UserCache(
+        app,
+        app.config.get('AUTH_USER_CACHE_SIZE', 4096),
+        app.config.get('AUTH_USER_CACHE_TTL', 5),
+        app.config.get('AUTH_USER_CACHE_REDIS_TTL', 3600))
+    user_hooks.append(app.user_cache.invalidate)
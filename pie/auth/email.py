@@ -1,17 +1,30 @@
 from sanic import response
 
-from ..services.aliyun.dm import send_single
+from ..ratelimit import Bucket, per_ip, rate_limit
+from ..services import outbox
 from ..db import db
 from .api import bp
-from .models import Token
+from .models import Token, normalize_email
+
+
+def _email(request):
+    return normalize_email(request.args.get('email'))
 
 
 @bp.route('/email')#, methods=['POST'])
+@rate_limit(
+    Bucket('auth_email', _email, rate=1 / 60, capacity=3),
+    Bucket('auth_email_ip', per_ip, rate=1 / 6, capacity=10),
+    Bucket('auth_email_global', rate=50, capacity=200),
+)
 async def email_login(request):
-    email = request.args.get('email')
+    email = _email(request)
+    if not email:
+        return response.json(dict(success=False), status=400)
     async with db.transaction():
-        token = await Token.new(email=email, action=Token.Actions.login)
-    await send_single(email, '登录 PIE', '', f'''\
+        token = await request.app.token_store.new(
+            email=email, action=Token.Actions.login)
+        await outbox.enqueue(email, '登录 PIE', '', f'''\
 <html>
 <body>
     <a href="{request.app.url_for('auth.token_login', token=token, _external=True)}">
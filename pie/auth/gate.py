@@ -0,0 +1,70 @@
+import hashlib
+
+import sanic
+
+from ..redis.aioredis import Script
+
+ALLOWED = 0
+KNOWN_BAD = 1
+TOO_MANY_FAILURES = 2
+
+_check = Script('_check_token_gate', f'''\
+if (redis.call('EXISTS', KEYS[1]) == 1)
+then
+    return {KNOWN_BAD}
+end
+if (tonumber(redis.call('GET', KEYS[2]) or '0') >= tonumber(ARGV[1]))
+then
+    return {TOO_MANY_FAILURES}
+end
+return {ALLOWED}
+''')
+
+_reject = Script('_reject_token', '''\
+redis.call('SET', KEYS[1], '1', 'PX', ARGV[1])
+if (KEYS[2] ~= '')
+then
+    local rv = redis.call('INCR', KEYS[2])
+    if (rv == 1)
+    then
+        redis.call('PEXPIRE', KEYS[2], ARGV[2])
+    end
+    return rv
+end
+return 0
+''')
+
+
+class TokenGate:
+    prefix = 'PIE_TOKEN_GATE'
+
+    def __init__(self, app: sanic.Sanic):
+        self._app = app
+        self.ttl = app.config.get('TOKEN_GATE_TTL', 600)
+        self.ip_limit = app.config.get('TOKEN_GATE_IP_LIMIT', 20)
+        self.ip_window = app.config.get('TOKEN_GATE_IP_WINDOW', 300)
+
+    def _keys(self, request, token):
+        # keyed by the whole token: a wrong validator must not shadow the
+        # real token sharing its selector
+        digest = hashlib.sha256(token.encode('ascii')).hexdigest()
+        return [f'{self.prefix}:T:{digest}',
+                f'{self.prefix}:IP:{request.ip}']
+
+    async def check(self, request, token):
+        return await _check(self._app.redis, self._keys(request, token),
+                            [self.ip_limit])
+
+    async def reject(self, request, token):
+        await _reject(self._app.redis, self._keys(request, token),
+                      [int(self.ttl * 1000), int(self.ip_window * 1000)])
+
+    async def burn(self, request, token):
+        # a used token is never valid again, answer replays from Redis
+        await _reject(self._app.redis, self._keys(request, token)[:1] +
+                      [''], [int(self.ttl * 1000), 0])
+
+
+def init_app(app: sanic.Sanic):
+    if app.config.get('TOKEN_GATE', True):
+        app.token_gate = TokenGate(app)
@@ -0,0 +1,69 @@
+import asyncio
+import concurrent.futures
+import os
+
+import argon2
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+def _hash(password, time_cost, memory_cost, parallelism):
+    return argon2.PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost,
+        parallelism=parallelism).hash(password)
+
+
+def _verify(hash_, password):
+    try:
+        return argon2.PasswordHasher().verify(hash_, password)
+    except (argon2.exceptions.VerificationError, ValueError):
+        return False
+
+
+class Hasher:
+    def __init__(self, *, time_cost=2, memory_cost=512, parallelism=2,
+                 executor='process', workers=None, concurrency=None,
+                 queue_limit=64):
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+        self._hasher = argon2.PasswordHasher(
+            time_cost=time_cost, memory_cost=memory_cost,
+            parallelism=parallelism)
+        workers = workers or os.cpu_count() or 1
+        if executor == 'process':
+            self._executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._semaphore = asyncio.Semaphore(concurrency or workers)
+        self.queue_limit = queue_limit
+        self._queued = 0
+
+    async def _run(self, func, *args):
+        if self._queued >= self.queue_limit:
+            raise HasherBusyError()
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, func, *args)
+        finally:
+            self._semaphore.release()
+
+    async def hash(self, password):
+        return await self._run(_hash, password, self.time_cost,
+                               self.memory_cost, self.parallelism)
+
+    async def verify(self, hash_, password):
+        return await self._run(_verify, hash_, password)
+
+    def needs_rehash(self, hash_):
+        return self._hasher.check_needs_rehash(hash_)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
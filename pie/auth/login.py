@@ -1,3 +1,4 @@
+import asyncio
 import functools
 
 import sanic
@@ -5,17 +6,73 @@ from sanic.request import Request
 from sanic.response import text
 
 from ..session.redis import Session
+from .cache import UserCache
+
+_missing = object()
+
+
+class UserLoader:
+    def __init__(self, cache: UserCache):
+        self._cache = cache
+        self._batch = None
+
+    async def load(self, uid):
+        rv = self._cache.peek(uid, _missing)
+        if rv is not _missing:
+            return rv
+        if self._batch is None:
+            self._batch = set(), asyncio.ensure_future(self._dispatch())
+        ids, fut = self._batch
+        ids.add(uid)
+        return (await asyncio.shield(fut)).get(uid)
+
+    async def _dispatch(self):
+        # collect the ids wanted by all requests in this loop iteration
+        await asyncio.sleep(0)
+        ids, _ = self._batch
+        self._batch = None
+        return await self._cache.get_many(list(ids))
+
+
+def get_loader(app: sanic.Sanic) -> UserLoader:
+    rv = getattr(app, 'user_loader', None)
+    if rv is None:
+        rv = app.user_loader = UserLoader(app.user_cache)
+    return rv
 
 
 class Login:
-    pass
+    key = 'pie.auth.login.Login'
+
+    def __init__(self, request: Request):
+        self._request = request
+        self._user = None
+
+    async def _load_user(self):
+        session = await Session.of(self._request, keys=('uid',))
+        uid = session.get('uid')
+        if uid is None:
+            return None
+        return await get_loader(self._request.app).load(uid)
+
+    async def load_user(self):
+        if self._user is None:
+            self._user = asyncio.ensure_future(self._load_user())
+        return await asyncio.shield(self._user)
+
+    @classmethod
+    def of(cls, request: Request):
+        rv = request.get(cls.key)
+        if rv is None:
+            rv = request[cls.key] = cls(request)
+        return rv
 
 
 def load_identity(m):
     @functools.wraps(m)
     async def wrapper(request, *args, **kwargs):
-
-        pass
+        request['identity'] = await Login.of(request).load_user()
+        return await m(request, *args, **kwargs)
     return wrapper
 
 
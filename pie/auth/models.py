@@ -5,37 +5,73 @@ from datetime import datetime, timedelta
 from enum import Enum
 
 from asyncpg import UniqueViolationError
+from gino.crud import UpdateRequest
 from gino.json_support import StringProperty
 from sqlalchemy.dialects.postgresql import JSONB
 
-from ..db import db
+from ..db import after_commit, db
 from ..utils import retry_on
 
+user_hooks = []
+
+
+def normalize_email(email):
+    return email.strip().lower() if email else None
+
+
+async def _user_changed(user, *emails):
+    uid, emails = user.id, set(emails)
+
+    async def notify():
+        for hook in user_hooks:
+            await hook(uid, *emails)
+
+    # readers would re-cache the old row until the transaction commits
+    await after_commit(notify)
+
+
+class UserUpdateRequest(UpdateRequest):
+    async def apply(self, *args, **kwargs):
+        email = self._instance.email
+        rv = await super().apply(*args, **kwargs)
+        await _user_changed(self._instance, email, self._instance.email)
+        return rv
+
 
 class User(db.Model):
     __tablename__ = 'users'
+    # only instance-level update()/delete() notify user_hooks, bulk
+    # User.update/User.delete statements must invalidate on their own
+    _update_request_cls = UserUpdateRequest
 
     id = db.Column(db.BigInteger(), primary_key=True)
     email = db.Column(db.Unicode(), index=True, unique=True)
     password = db.Column(db.Unicode())
     profile = db.Column(JSONB(), nullable=False, server_default='{}')
 
+    async def _delete(self, *args, **kwargs):
+        rv = await super()._delete(*args, **kwargs)
+        await _user_changed(self, self.email)
+        return rv
+
 
 class Token(db.Model):
     __tablename__ = 'tokens'
 
     class Actions:
         login = 'login'
+        set_password = 'set_password'
 
     id = db.Column(db.BigInteger(), primary_key=True)
     selector = db.Column(db.Unicode(), nullable=False, index=True, unique=True)
     validator = db.Column(db.Unicode(), nullable=False)
     created_at = db.Column(db.DateTime(), nullable=False)
-    expires_at = db.Column(db.DateTime(), nullable=False)
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)
     used_at = db.Column(db.DateTime())
     profile = db.Column(JSONB(), nullable=False, server_default='{}')
     action = StringProperty()
     email = StringProperty()
+    password = StringProperty()
 
     @classmethod
     def _split(cls, token):
@@ -66,3 +102,28 @@ class Token(db.Model):
 
     async def use(self):
         await self.update(used_at=datetime.utcnow()).apply()
+
+    @classmethod
+    async def consume(cls, token):
+        selector, validator = cls._split(token)
+        now = datetime.utcnow()
+        return await cls.update.values(used_at=now).where(
+            (cls.selector == selector) &
+            (cls.validator == validator) &
+            cls.used_at.is_(None) &
+            (cls.expires_at >= now)
+        ).returning(*cls).gino.load(cls).first()
+
+
+class TokenArchive(db.Model):
+    __tablename__ = 'tokens_archive'
+
+    id = db.Column(db.BigInteger(), primary_key=True)
+    selector = db.Column(db.Unicode(), nullable=False)
+    validator = db.Column(db.Unicode(), nullable=False)
+    created_at = db.Column(db.DateTime(), nullable=False)
+    expires_at = db.Column(db.DateTime(), nullable=False)
+    used_at = db.Column(db.DateTime())
+    profile = db.Column(JSONB(), nullable=False, server_default='{}')
+    archived_at = db.Column(db.DateTime(), nullable=False,
+                            server_default=db.text('now()'))
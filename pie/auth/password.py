@@ -0,0 +1,126 @@
+import os
+
+import sanic
+from asyncpg import UniqueViolationError
+from sanic import response
+
+from ..db import db
+from ..ratelimit import Bucket, per_ip, rate_limit
+from ..services import outbox
+from ..session.redis import Session
+from .api import bp
+from .hashing import Hasher, HasherBusyError
+from .models import Token, User, normalize_email
+from .token import action
+
+
+def _get_credentials(request):
+    if 'json' in request.headers.get('Content-Type', ''):
+        data = request.json or {}
+    else:
+        data = request.form
+    email = normalize_email(data.get('email'))
+    password = data.get('password')
+    if email and password:
+        return email, password
+    return None, None
+
+
+def _email(request):
+    return _get_credentials(request)[0]
+
+
+@bp.exception(HasherBusyError)
+async def hasher_busy(request, exception):
+    return response.json(dict(success=False, error='Server busy.'),
+                         status=503, headers={'Retry-After': '1'})
+
+
+@bp.post('/password/register')
+@rate_limit(
+    Bucket('auth_password_register', _email, rate=1 / 60, capacity=3),
+    Bucket('auth_password_register_ip', per_ip, rate=1 / 6, capacity=10),
+)
+async def password_register(request):
+    email, password = _get_credentials(request)
+    if not email:
+        return response.json(dict(success=False), status=400)
+    # nothing is stored until the owner of the address follows the link
+    password = await request.app.password_hasher.hash(password)
+    async with db.transaction():
+        token = await request.app.token_store.new(
+            email=email, password=password, action=Token.Actions.set_password)
+        await outbox.enqueue(email, '设置 PIE 密码', '', f'''\
+<html>
+<body>
+    <a href="{request.app.url_for('auth.token_login', token=token, _external=True)}">
+        请点击确认密码
+    </a>
+</body>
+</html>
+''')
+    # the same answer whether the account exists or not
+    return response.json(dict(success=True))
+
+
+@action
+async def set_password(request, token):
+    while True:
+        u = await User.query.where(User.email == token.email).gino.first()
+        if u is not None:
+            await u.update(password=token.password).apply()
+            break
+        try:
+            u = await User.create(email=token.email, password=token.password)
+            break
+        except UniqueViolationError:
+            continue
+    session = await Session.of(request)
+    session.set('uid', u.id)
+    return response.json(dict(success=True))
+
+
+@bp.post('/password/login')
+@rate_limit(
+    Bucket('auth_password_login', _email, rate=1 / 10, capacity=10),
+    Bucket('auth_password_login_ip', per_ip, rate=1, capacity=30),
+)
+async def password_login(request):
+    email, password = _get_credentials(request)
+    if not email:
+        return response.json(dict(success=False), status=400)
+    hasher = request.app.password_hasher
+    u = await User.query.where(User.email == email).gino.first()
+    if u is None or not u.password:
+        # spend the same time as a real check to not leak existing emails
+        await hasher.verify(request.app.password_dummy_hash, password)
+        return response.json(dict(success=False), status=401)
+    if not await hasher.verify(u.password, password):
+        return response.json(dict(success=False), status=401)
+    if hasher.needs_rehash(u.password):
+        await u.update(password=await hasher.hash(password)).apply()
+    session = await Session.of(request)
+    session.set('uid', u.id)
+    return response.json(dict(success=True))
+
+
+def init_app(app: sanic.Sanic):
+    @app.listener('before_server_start')
+    async def before_server_start(*_):
+        app.password_hasher = Hasher(
+            time_cost=app.config.get('AUTH_ARGON2_TIME_COST', 2),
+            memory_cost=app.config.get('AUTH_ARGON2_MEMORY_COST', 512),
+            parallelism=app.config.get('AUTH_ARGON2_PARALLELISM', 2),
+            executor=app.config.get('AUTH_HASH_EXECUTOR', 'process'),
+            workers=app.config.get('AUTH_HASH_WORKERS'),
+            concurrency=app.config.get('AUTH_HASH_CONCURRENCY'),
+            queue_limit=app.config.get('AUTH_HASH_QUEUE_LIMIT', 64),
+        )
+        app.password_dummy_hash = await app.password_hasher.hash(
+            os.urandom(16).hex())
+
+    @app.listener('after_server_stop')
+    async def after_server_stop(*_):
+        hasher = getattr(app, 'password_hasher', None)
+        if hasher is not None:
+            hasher.close()
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+import sanic
+from sqlalchemy import text
+
+from ..db import db
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_DELETE = '''\
+WITH batch AS (
+    SELECT id FROM tokens
+    WHERE expires_at < :cutoff
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+DELETE FROM tokens USING batch WHERE tokens.id = batch.id
+'''
+_ARCHIVE = '''\
+WITH batch AS (
+    SELECT id FROM tokens
+    WHERE expires_at < :cutoff
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+), moved AS (
+    DELETE FROM tokens USING batch WHERE tokens.id = batch.id
+    RETURNING tokens.*
+)
+INSERT INTO tokens_archive
+    (id, selector, validator, created_at, expires_at, used_at, profile)
+SELECT id, selector, validator, created_at, expires_at, used_at,
+       profile - 'password'
+FROM moved
+'''
+
+
+async def prune_batch(cutoff: datetime, batch_size=500, archive=False):
+    status, _ = await db.status(text(_ARCHIVE if archive else _DELETE),
+                                cutoff=cutoff, batch_size=batch_size)
+    return int(status.split()[-1])
+
+
+async def prune(grace=timedelta(days=1), batch_size=500, pause=0.1,
+                archive=False):
+    cutoff = datetime.utcnow() - grace
+    rv = 0
+    while True:
+        count = await prune_batch(cutoff, batch_size, archive)
+        rv += count
+        if count < batch_size:
+            break
+        await asyncio.sleep(pause)
+    registry.inc('tokens_pruned_total', rv)
+    return rv
+
+
+def init_app(app: sanic.Sanic):
+    interval = app.config.get('TOKEN_RETENTION_INTERVAL')
+    if not interval:
+        return
+
+    async def run():
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            try:
+                count = await prune(
+                    grace=timedelta(seconds=app.config.get(
+                        'TOKEN_RETENTION_GRACE', 86400)),
+                    batch_size=app.config.get('TOKEN_RETENTION_BATCH', 500),
+                    pause=app.config.get('TOKEN_RETENTION_PAUSE', 0.1),
+                    archive=app.config.get('TOKEN_RETENTION_ARCHIVE', False))
+                logger.info('Pruned %d expired tokens', count)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to prune tokens')
+
+    @app.listener('after_server_start')
+    async def after_server_start(_, loop):
+        app.token_retention = loop.create_task(run())
+
+    @app.listener('before_server_stop')
+    async def before_server_stop(*_):
+        task = getattr(app, 'token_retention', None)
+        if task is not None:
+            task.cancel()
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+from datetime import timedelta
+
+import aioredis
+import sanic
+
+from ..redis.aioredis import Script
+from ..utils import retry_on
+from .models import Token
+
+
+class RetryError(aioredis.ReplyError):
+    MATCH_REPLY = 'RETRY Token collision'
+
+
+class TokenStore:
+    async def new(self, ttl=timedelta(minutes=10), **payload) -> str:
+        pass
+
+    async def consume(self, token):
+        pass
+
+
+class GinoTokenStore(TokenStore):
+    async def new(self, ttl=timedelta(minutes=10), **payload):
+        return await Token.new(ttl, **payload)
+
+    async def consume(self, token):
+        return await Token.consume(token)
+
+
+class RedisToken:
+    def __init__(self, selector, profile: dict):
+        self.selector = selector
+        self.profile = profile
+
+    def __getattr__(self, item):
+        try:
+            return self.profile[item]
+        except KeyError:
+            return None
+
+
+_create = Script('_create_token', f'''\
+if (redis.call('EXISTS', KEYS[1]) == 1)
+then
+    return {{err = '{RetryError.MATCH_REPLY}'}}
+end
+redis.call('HMSET', KEYS[1], 'validator', ARGV[1], 'profile', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+''')
+
+_consume = Script('_consume_token', '''\
+if (redis.call('HGET', KEYS[1], 'validator') ~= ARGV[1])
+then
+    return false
+end
+local rv = redis.call('HGET', KEYS[1], 'profile')
+redis.call('DEL', KEYS[1])
+return rv
+''')
+
+
+class RedisTokenStore(TokenStore):
+    prefix = 'PIE_TOKEN'
+
+    def __init__(self, app: sanic.Sanic):
+        self._app = app
+
+    def _key(self, selector):
+        return f'{self.prefix}:{selector}'
+
+    @retry_on(RetryError)
+    async def new(self, ttl=timedelta(minutes=10), **payload):
+        rv = hashlib.sha3_256(os.urandom(32)).hexdigest()
+        selector, validator = Token._split(rv)
+        await _create(self._app.redis, [self._key(selector)], [
+            validator, json.dumps(payload), int(ttl.total_seconds() * 1000)])
+        return rv
+
+    async def consume(self, token):
+        selector, validator = Token._split(token)
+        rv = await _consume(self._app.redis, [self._key(selector)],
+                            [validator])
+        if rv is not None:
+            if isinstance(rv, bytes):
+                rv = rv.decode('utf-8')
+            return RedisToken(selector, json.loads(rv))
+
+
+def init_app(app: sanic.Sanic):
+    if app.config.get('AUTH_TOKEN_STORE') == 'redis':
+        app.token_store = RedisTokenStore(app)
+    else:
+        app.token_store = GinoTokenStore()
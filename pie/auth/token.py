@@ -1,9 +1,8 @@
 from sanic import response
 
+from . import gate
 from .api import bp
-from .models import User, Token
 from ..session.redis import Session
-from ..db import db
 
 _actions = {}
 
@@ -14,13 +13,10 @@ def action(m):
 
 
 @action
-async def login(request, token: Token):
-    conditions = []
-    if token.email:
-        conditions.append(User.email == token.email)
-    if not conditions:
+async def login(request, token):
+    if not token.email:
         return response.json(dict(success=False))
-    u = await User.query.where(*conditions).gino.first()
+    u = await request.app.user_cache.get_by_email(token.email)
     if u:
         session = await Session.of(request)
         session.set('uid', u.id)
@@ -31,10 +27,20 @@ async def login(request, token: Token):
 
 @bp.get('/token/<token:[a-fA-F0-9]{64}>')
 async def token_login(request, token):
-    async with db.transaction():
-        token = await Token.verify(token.lower())
-        if token is None:
+    token = token.lower()
+    token_gate = getattr(request.app, 'token_gate', None)
+    if token_gate is not None:
+        result = await token_gate.check(request, token)
+        if result == gate.TOO_MANY_FAILURES:
+            return response.text('too many attempts', status=429)
+        elif result == gate.KNOWN_BAD:
             return response.text('invalid')
-        else:
-            await token.use()
-            return await _actions[token.action](request, token)
+    rv = await request.app.token_store.consume(token)
+    if rv is None:
+        if token_gate is not None:
+            await token_gate.reject(request, token)
+        return response.text('invalid')
+    else:
+        if token_gate is not None:
+            await token_gate.burn(request, token)
+        return await _actions[rv.action](request, rv)
@@ -0,0 +1,132 @@
+import collections
+import functools
+import time
+
+import sanic
+from sanic import response
+
+from .metrics import registry
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breakers = {}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, breaker):
+        super().__init__(f'Circuit {breaker.name!r} is open.')
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    def __init__(self, name, *, errors=(Exception,), window=10, min_calls=20,
+                 failure_ratio=0.5, reset_timeout=5, half_open_calls=1):
+        self.name = name
+        self.errors = errors
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._calls = collections.deque()
+        self._failures = 0
+        self._opened_at = 0
+        self._trials = 0
+        registry.gauge('circuit_breaker_state',
+                       lambda: _STATE_VALUES[self.state], breaker=name)
+
+    def configure(self, **config):
+        for key, value in config.items():
+            if key.startswith('_') or not hasattr(self, key):
+                raise TypeError(f'Unknown circuit breaker option {key!r}.')
+            setattr(self, key, value)
+
+    def _set_state(self, state):
+        if self.state != state:
+            self.state = state
+            registry.inc('circuit_breaker_transitions_total',
+                         breaker=self.name, state=state)
+
+    def _open(self, now):
+        self._set_state(OPEN)
+        self._opened_at = now
+        self._calls.clear()
+        self._failures = 0
+
+    def _record(self, now, failed):
+        self._calls.append((now, failed))
+        self._failures += failed
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._failures -= self._calls.popleft()[1]
+        if len(self._calls) >= self.min_calls and \
+                self._failures >= len(self._calls) * self.failure_ratio:
+            self._open(now)
+
+    def before_call(self):
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(self)
+            self._set_state(HALF_OPEN)
+            self._trials = 0
+        if self.state == HALF_OPEN:
+            if self._trials >= self.half_open_calls:
+                raise CircuitOpenError(self)
+            self._trials += 1
+
+    def on_success(self):
+        if self.state == HALF_OPEN:
+            self._set_state(CLOSED)
+        elif self.state == CLOSED:
+            self._record(time.monotonic(), False)
+
+    def on_failure(self):
+        if self.state == HALF_OPEN:
+            self._open(time.monotonic())
+        elif self.state == CLOSED:
+            self._record(time.monotonic(), True)
+
+    async def call(self, m, *args, **kwargs):
+        self.before_call()
+        try:
+            rv = await m(*args, **kwargs)
+        except self.errors:
+            self.on_failure()
+            raise
+        except BaseException:
+            # not a dependency failure (cancelled, application-level error)
+            if self.state == HALF_OPEN:
+                self._trials -= 1
+            raise
+        else:
+            self.on_success()
+            return rv
+
+    def __call__(self, m):
+        @functools.wraps(m)
+        async def wrapper(*args, **kwargs):
+            return await self.call(m, *args, **kwargs)
+        return wrapper
+
+
+def get_breaker(name, **config) -> CircuitBreaker:
+    rv = breakers.get(name)
+    if rv is None:
+        rv = breakers[name] = CircuitBreaker(name, **config)
+    return rv
+
+
+def init_app(app: sanic.Sanic):
+    for name, config in app.config.get('CIRCUIT_BREAKERS', {}).items():
+        get_breaker(name).configure(**config)
+
+    @app.exception(CircuitOpenError)
+    async def circuit_open(request, exception):
+        return response.json(
+            dict(success=False, error=str(exception)), status=503,
+            headers={'Retry-After': str(
+                max(1, int(exception.breaker.reset_timeout)))})
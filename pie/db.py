@@ -1,11 +1,308 @@
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+
+import asyncpg
 import sanic
+from gino import create_engine
 from gino.ext.sanic import Gino
+from sqlalchemy import text
+from sqlalchemy.sql import Select
+
+from .circuit import CircuitOpenError, get_breaker
+from .metrics import registry
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    from aiocontextvars import ContextVar
+
+logger = logging.getLogger(__name__)
 db = Gino()
+breaker = get_breaker('db', errors=(
+    OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError))
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+_LAG_SQL = '''\
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()),
+              0) END'''
+
+_target = ContextVar('pie_db_target', default=None)
+_tx_depth = ContextVar('pie_db_tx_depth', default=0)
+_request_state = ContextVar('pie_db_request_state', default=None)
+_after_commit = ContextVar('pie_db_after_commit', default=None)
+
+
+@contextlib.contextmanager
+def reads_from(target):
+    prev = _target.get()
+    _target.set(target)
+    try:
+        yield
+    finally:
+        _target.set(prev)
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.breaker = get_breaker(f'db_replica_{name}', errors=breaker.errors)
+        self.lag = None
+        self.healthy = False
+        registry.gauge('db_replica_lag_seconds',
+                       lambda: -1 if self.lag is None else self.lag,
+                       replica=name)
+
+
+async def after_commit(callback):
+    callbacks = _after_commit.get()
+    if _tx_depth.get() and callbacks is not None:
+        callbacks.append(callback)
+    else:
+        await callback()
+
+
+class _Transaction:
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self._depth = None
+        self._callbacks = None
+        self._open = False
+
+    def _enter(self):
+        self._open = True
+        self._depth = _tx_depth.get()
+        _tx_depth.set(self._depth + 1)
+        if not self._depth:
+            self._callbacks = []
+            _after_commit.set(self._callbacks)
+
+    async def _exit(self, committed):
+        if not self._open:
+            return
+        self._open = False
+        _tx_depth.set(self._depth)
+        if not self._depth:
+            _after_commit.set(None)
+        if committed and self._callbacks:
+            for callback in self._callbacks:
+                await callback()
+
+    def __await__(self):
+        return self._begin().__await__()
+
+    async def _begin(self):
+        self._enter()
+        try:
+            return _ManualTransaction(self, await self._ctx)
+        except BaseException:
+            await self._exit(False)
+            raise
+
+    async def __aenter__(self):
+        self._enter()
+        try:
+            return await self._ctx.__aenter__()
+        except BaseException:
+            await self._exit(False)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            rv = await self._ctx.__aexit__(*exc_info)
+        except BaseException:
+            await self._exit(False)
+            raise
+        await self._exit(exc_info[0] is None)
+        return rv
+
+
+class _ManualTransaction:
+    def __init__(self, owner, tx):
+        self._owner = owner
+        self._tx = tx
+
+    def __getattr__(self, item):
+        return getattr(self._tx, item)
+
+    async def commit(self):
+        try:
+            await self._tx.commit()
+        except BaseException:
+            await self._owner._exit(False)
+            raise
+        await self._owner._exit(True)
+
+    async def rollback(self):
+        try:
+            await self._tx.rollback()
+        finally:
+            await self._owner._exit(False)
+
+
+def _wrote():
+    state = _request_state.get()
+    if state is not None:
+        state['wrote'] = True
+
+
+class TransactionEngine:
+    def __init__(self, primary):
+        self.primary = primary
+
+    def __getattr__(self, item):
+        return getattr(self.primary, item)
+
+    def transaction(self, *args, **kwargs):
+        return _Transaction(self.primary.transaction(*args, **kwargs))
+
+    async def _execute(self, method, clause, *multiparams, **params):
+        return await breaker.call(getattr(self.primary, method), clause,
+                                  *multiparams, **params)
+
+    async def all(self, clause, *multiparams, **params):
+        return await self._execute('all', clause, *multiparams, **params)
+
+    async def first(self, clause, *multiparams, **params):
+        return await self._execute('first', clause, *multiparams, **params)
+
+    async def scalar(self, clause, *multiparams, **params):
+        return await self._execute('scalar', clause, *multiparams, **params)
+
+    async def status(self, clause, *multiparams, **params):
+        return await self._execute('status', clause, *multiparams, **params)
+
+
+class RoutingEngine(TransactionEngine):
+    def __init__(self, primary, replicas):
+        super().__init__(primary)
+        self.replicas = replicas
+        self._next = itertools.count()
+
+    def _pick(self, clause):
+        if not isinstance(clause, Select) or \
+                clause._for_update_arg is not None:
+            _wrote()
+            return None
+        # only plain reads outside transactions may leave the primary
+        target = _target.get()
+        if target == PRIMARY or _tx_depth.get():
+            return None
+        if target != REPLICA:
+            state = _request_state.get()
+            if state is not None and (state['pinned'] or state['wrote']):
+                return None
+        healthy = [r for r in self.replicas if r.healthy]
+        if healthy:
+            return healthy[next(self._next) % len(healthy)]
+
+    async def _execute(self, method, clause, *multiparams, **params):
+        replica = self._pick(clause)
+        if replica is not None:
+            try:
+                rv = await replica.breaker.call(
+                    getattr(replica.engine, method), clause,
+                    *multiparams, **params)
+            except (CircuitOpenError,) + breaker.errors:
+                registry.inc('db_replica_fallbacks_total',
+                             replica=replica.name)
+            else:
+                registry.inc('db_reads_total', target=REPLICA)
+                return rv
+        return await super()._execute(method, clause, *multiparams, **params)
+
+    async def check_lag(self, max_lag):
+        for replica in self.replicas:
+            try:
+                replica.lag = float(await replica.engine.scalar(
+                    text(_LAG_SQL)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Replica %s lag check failed: %s',
+                               replica.name, e)
+                replica.lag = None
+            replica.healthy = replica.lag is not None and \
+                replica.lag <= max_lag
+
+    async def close(self):
+        for replica in self.replicas:
+            await replica.engine.close()
+        await self.primary.close()
+
+
+def _install_transactions(app: sanic.Sanic):
+    @app.listener('before_server_start')
+    async def before_server_start(*_):
+        db.bind = TransactionEngine(db.bind)
+
+
+def _install_routing(app: sanic.Sanic, dsns):
+    interval = app.config.get('DB_REPLICA_CHECK_INTERVAL', 1)
+    max_lag = app.config.get('DB_REPLICA_MAX_LAG', 5)
+    window = app.config.get('DB_READ_YOUR_WRITES', 5)
+    cookie = app.config.get('DB_READ_YOUR_WRITES_COOKIE', 'pie_ryw')
+
+    async def monitor(engine):
+        while True:
+            await engine.check_lag(max_lag)
+            await asyncio.sleep(interval)
+
+    @app.listener('before_server_start')
+    async def before_server_start(_, loop):
+        replicas = []
+        for i, dsn in enumerate(dsns):
+            replicas.append(Replica(str(i), await create_engine(
+                dsn,
+                min_size=app.config.get('DB_POOL_MIN_SIZE', 5),
+                max_size=app.config.get('DB_POOL_MAX_SIZE', 10),
+                loop=loop)))
+        db.bind = RoutingEngine(db.bind, replicas)
+
+    @app.listener('after_server_start')
+    async def after_server_start(_, loop):
+        app.db_replica_monitor = loop.create_task(monitor(db.bind))
+
+    @app.listener('before_server_stop')
+    async def before_server_stop(*_):
+        task = getattr(app, 'db_replica_monitor', None)
+        if task is not None:
+            task.cancel()
+
+    @app.middleware('request')
+    async def on_request(request):
+        # pin this client to the primary until its last write has replicated
+        try:
+            pinned = float(request.cookies.get(cookie, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        _request_state.set(dict(pinned=pinned, wrote=False))
+
+    @app.middleware('response')
+    async def on_response(request, response):
+        state = _request_state.get()
+        if window and state is not None and state['wrote']:
+            response.cookies[cookie] = str(int(time.time() + window))
+            response.cookies[cookie]['max-age'] = window
+            response.cookies[cookie]['httponly'] = True
 
 
 def init_app(app: sanic.Sanic):
     from .auth import models
+    from .services import outbox
 
     app.config.setdefault('DB_DATABASE', 'pie')
     db.init_app(app)
+    dsns = app.config.get('DB_REPLICAS')
+    if dsns:
+        _install_routing(app, dsns)
+    else:
+        # after_commit() needs transactions to go through the wrapper
+        _install_transactions(app)
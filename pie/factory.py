@@ -4,15 +4,33 @@ import sanic
 def get_app():
     app = sanic.Sanic(__name__)
 
+    from .metrics import init_app
+    init_app(app)
+
+    from .circuit import init_app
+    init_app(app)
+
     from .db import init_app
     init_app(app)
 
     from .redis.aioredis import init_app
     init_app(app)
 
-    from .session.redis import Session
+    from .services.aliyun.client import init_app
+    init_app(app)
+
+    from .services.outbox import init_app
+    init_app(app)
+
+    if app.config.get('SESSION_BACKEND') == 'cookie':
+        from .session.cookie import Session
+    else:
+        from .session.redis import Session
     Session.install(app)
 
+    from .session.sweeper import init_app
+    init_app(app)
+
     from .auth.api import init_app
     init_app(app)
 
@@ -0,0 +1,107 @@
+import bisect
+import collections
+
+import sanic
+from sanic import response
+
+from .utils import retry_hooks
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _notify(self, kind, name, value, labels):
+        for hook in self.hooks:
+            hook(kind, name, value, labels)
+
+    def inc(self, name, value=1, **labels):
+        self.counters[name, tuple(sorted(labels.items()))] += value
+        self._notify('counter', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = name, tuple(sorted(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+        self._notify('histogram', name, value, labels)
+
+    def gauge(self, name, func, **labels):
+        self.gauges[name, tuple(sorted(labels.items()))] = func
+
+    def render(self):
+        lines = []
+        gauges = {key: func() for key, func in self.gauges.items()}
+        for kind, items in (('counter', self.counters), ('gauge', gauges)):
+            last = None
+            for (name, labels), value in _sorted(items):
+                if name != last:
+                    lines.append(f'# TYPE {name} {kind}')
+                    last = name
+                lines.append(f'{name}{_labels(labels)} {value}')
+        last = None
+        for (name, labels), histogram in _sorted(self.histograms):
+            if name != last:
+                lines.append(f'# TYPE {name} histogram')
+                last = name
+            total = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+                lines.append(f'{name}_bucket'
+                             f'{_labels(labels + (("le", bound),))} {total}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))}'
+                         f' {histogram.count}')
+            lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _sorted(items: dict):
+    return sorted(items.items(),
+                  key=lambda item: (item[0][0], str(item[0][1])))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in labels)
+
+
+registry = Registry()
+retry_hooks.append(lambda name, attempt, error: registry.inc(
+    'retry_attempts_total', function=name, error=type(error).__name__))
+
+
+def init_app(app: sanic.Sanic):
+    uri = app.config.get('METRICS_URI')
+    if uri:
+        @app.route(uri)
+        async def metrics(request):
+            return response.text(registry.render(),
+                                 content_type='text/plain; version=0.0.4')
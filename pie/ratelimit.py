@@ -0,0 +1,111 @@
+import functools
+import hashlib
+import math
+import time
+
+from sanic import response
+
+from .redis.aioredis import Script
+
+_acquire = Script('_acquire_rate_limit', '''\
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local capacity = tonumber(ARGV[i * 2 + 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    available = math.min(capacity, available + elapsed * rate)
+    if (available < cost)
+    then
+        wait = math.max(wait, (cost - available) / rate)
+    end
+    tokens[i] = available
+end
+if (wait > 0)
+then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local capacity = tonumber(ARGV[i * 2 + 2])
+    redis.call('HMSET', key, 'tokens', tostring(tokens[i] - cost),
+               'ts', ARGV[1])
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return '0'
+''')
+
+
+def _check_limits(name, rate, capacity=None):
+    if capacity is None:
+        # a bucket must hold at least one token to ever grant a request
+        capacity = max(rate, 1)
+    if rate <= 0 or capacity < 1:
+        raise ValueError(f'Invalid rate limit {name!r}: rate {rate!r}, '
+                         f'capacity {capacity!r}.')
+    return rate, capacity
+
+
+class Bucket:
+    prefix = 'PIE_RATE_LIMIT'
+
+    def __init__(self, name, key=None, *, rate=1, capacity=None):
+        self.name = name
+        self.key = key
+        self.rate, self.capacity = _check_limits(name, rate, capacity)
+
+    def get_limits(self, app):
+        limits = app.config.get('RATE_LIMITS', {}).get(self.name)
+        if limits is None:
+            return self.rate, self.capacity
+        if isinstance(limits, (int, float)):
+            limits = limits,
+        return _check_limits(self.name, *limits)
+
+    def get_key(self, request):
+        if self.key is None:
+            return f'{self.prefix}:{self.name}'
+        value = self.key(request)
+        if value is None:
+            return None
+        value = hashlib.sha1(str(value).encode('utf-8')).hexdigest()
+        return f'{self.prefix}:{self.name}:{value}'
+
+
+def per_ip(request):
+    return request.ip
+
+
+async def acquire(app, request, buckets, cost=1):
+    keys = []
+    args = [time.time(), cost]
+    for bucket in buckets:
+        key = bucket.get_key(request)
+        if key is not None:
+            rate, capacity = bucket.get_limits(app)
+            if cost > capacity:
+                raise ValueError(f'Cost {cost} exceeds the capacity of rate '
+                                 f'limit {bucket.name!r}.')
+            keys.append(key)
+            args.extend((rate, capacity))
+    if not keys:
+        return 0
+    return float(await _acquire(app.redis, keys, args))
+
+
+def rate_limit(*buckets: Bucket, cost=1):
+    def decorator(m):
+        @functools.wraps(m)
+        async def wrapper(request, *args, **kwargs):
+            wait = await acquire(request.app, request, buckets, cost)
+            if wait > 0:
+                return response.json(
+                    dict(success=False, error='Too many requests.'),
+                    status=429, headers={'Retry-After': str(math.ceil(wait))})
+            return await m(request, *args, **kwargs)
+        return wrapper
+    return decorator
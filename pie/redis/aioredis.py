@@ -1,16 +1,274 @@
+import asyncio
+import bisect
+import collections
+import functools
+import hashlib
+import logging
+import time
+
 import aioredis
 import sanic
+from aioredis.errors import ConnectionClosedError, PoolClosedError
+from aioredis.sentinel.pool import ManagedPool
+
+from ..circuit import get_breaker
+from ..metrics import registry
+
+logger = logging.getLogger(__name__)
+scripts = {}
+noscript_fallbacks = collections.Counter()
+breaker = get_breaker('redis', errors=(
+    OSError, asyncio.TimeoutError, ConnectionClosedError, PoolClosedError))
+_reloading = {}
+
+
+class NoScriptError(aioredis.ReplyError):
+    MATCH_REPLY = 'NOSCRIPT'
+
+
+class Script:
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.sha1 = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        scripts[self.sha1] = self
+
+    # noinspection PyDefaultArgument
+    @breaker
+    async def __call__(self, redis, keys=[], args=[]):
+        try:
+            return await redis.evalsha(self.sha1, keys, args)
+        except NoScriptError:
+            noscript_fallbacks[self.name] += 1
+            registry.inc('redis_noscript_fallbacks_total', script=self.name)
+            _schedule_reload(redis)
+            return await redis.eval(self.text, keys, args)
+
+
+def script(m):
+    s = Script(m.__name__, m(None))
+
+    # noinspection PyDefaultArgument
+    @functools.wraps(m)
+    async def wrapper(self, keys=[], args=[]):
+        return await s(get_redis(self._app, keys[0] if keys else None),
+                       keys, args)
+    wrapper.script = s
+    return wrapper
+
+
+class HashRing:
+    def __init__(self, nodes: dict, vnodes=160):
+        self._ring = []
+        for name, node in nodes.items():
+            for i in range(vnodes):
+                self._ring.append((self._hash(f'{name}#{i}'), node))
+        self._ring.sort(key=lambda item: item[0])
+        self._hashes = [item[0] for item in self._ring]
+        self.nodes = list(nodes.values())
+
+    @staticmethod
+    def _hash(key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        return int.from_bytes(hashlib.md5(key).digest()[:8], 'big')
+
+    def get(self, key):
+        index = bisect.bisect(self._hashes, self._hash(key))
+        return self._ring[index % len(self._ring)][1]
+
+
+def get_redis(app, key=None):
+    shards = getattr(app, 'redis_shards', None)
+    if shards is None or key is None:
+        return app.redis
+    return shards.get(key)
+
+
+def all_redis(app):
+    shards = getattr(app, 'redis_shards', None)
+    if shards is None:
+        return [app.redis]
+    return shards.nodes
+
+
+class ReconnectBackoff:
+    reconnect_delay = 0.1
+    reconnect_max_delay = 5
+    _backoff = 0
+    _retry_at = 0
+
+    async def _create_new_connection(self, address):
+        # while the server is away (e.g. during a failover) space out the
+        # reconnects of this pool instead of failing every command at once
+        wait = self._retry_at - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            rv = await super()._create_new_connection(address)
+        except (OSError, asyncio.TimeoutError, aioredis.RedisError):
+            self._backoff = min(self._backoff * 2 or self.reconnect_delay,
+                                self.reconnect_max_delay)
+            self._retry_at = time.monotonic() + self._backoff
+            registry.inc('redis_reconnect_failures_total')
+            raise
+        self._backoff = 0
+        return rv
+
+
+class InstrumentedPool:
+    pool_name = 'default'
+
+    async def acquire(self, *args, **kwargs):
+        # commands only get here when no connection is free
+        start = time.perf_counter()
+        try:
+            return await super().acquire(*args, **kwargs)
+        finally:
+            registry.observe('redis_pool_wait_seconds',
+                             time.perf_counter() - start, pool=self.pool_name)
+
+
+def pool_class(base, name='default', delay=0.1, max_delay=5,
+               metrics=False):
+    mixins = (ReconnectBackoff,)
+    if metrics:
+        mixins += (InstrumentedPool,)
+    return type(base.__name__, mixins + (base,), dict(
+        __module__=__name__, reconnect_delay=delay,
+        reconnect_max_delay=max_delay, pool_name=name))
+
+
+class SentinelPool(aioredis.sentinel.SentinelPool):
+    def master_for(self, service, pool_cls=ManagedPool):
+        # same as upstream, but lets the caller pick the pool class
+        if service not in self._masters:
+            self._masters[service] = pool_cls(
+                self, service, is_master=True,
+                db=self._redis_db,
+                password=self._redis_password,
+                encoding=self._redis_encoding,
+                minsize=self._redis_minsize,
+                maxsize=self._redis_maxsize,
+                ssl=self._redis_ssl,
+                parser=self._parser_class,
+                loop=self._loop)
+        return self._masters[service]
+
+
+class RedisSentinel(aioredis.RedisSentinel):
+    def master_for(self, name, pool_cls=ManagedPool):
+        return aioredis.Redis(self._pool.master_for(name, pool_cls))
+
+
+class InstrumentedRedis(aioredis.Redis):
+    def __init__(self, pool_or_conn, name='default'):
+        super().__init__(pool_or_conn)
+        self.name = name
+        for attr in ('size', 'freesize', 'maxsize'):
+            if hasattr(pool_or_conn, attr):
+                registry.gauge(f'redis_pool_{attr}',
+                               functools.partial(getattr, pool_or_conn, attr),
+                               pool=name)
+
+    def execute(self, command, *args, **kwargs):
+        return self._observe(
+            super().execute(command, *args, **kwargs), command, args)
+
+    async def _observe(self, fut, command, args):
+        if isinstance(command, bytes):
+            command = command.decode('utf-8')
+        command = command.upper()
+        labels = dict(pool=self.name, command=command)
+        if command == 'EVALSHA' and args:
+            labels['script'] = getattr(scripts.get(args[0]), 'name', '')
+        elif command == 'EVAL' and args:
+            labels['script'] = getattr(scripts.get(hashlib.sha1(
+                args[0].encode('utf-8')).hexdigest()), 'name', '')
+        start = time.perf_counter()
+        try:
+            return await fut
+        except Exception as e:
+            registry.inc('redis_command_errors_total',
+                         error=type(e).__name__, **labels)
+            raise
+        finally:
+            registry.observe('redis_command_seconds',
+                             time.perf_counter() - start, **labels)
+
+
+async def load_scripts(redis):
+    await asyncio.gather(*[redis.script_load(s.text)
+                           for s in list(scripts.values())])
+
+
+def _schedule_reload(redis):
+    # a NOSCRIPT means the server lost its script cache (restart, failover),
+    # so reload everything at once instead of missing once per script
+    if redis in _reloading:
+        return
+
+    def done(fut):
+        _reloading.pop(redis, None)
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.warning('Failed to reload Redis scripts: %s',
+                           fut.exception())
+
+    _reloading[redis] = asyncio.ensure_future(load_scripts(redis))
+    _reloading[redis].add_done_callback(done)
 
 
 def init_app(app: sanic.Sanic, *,
              parser=None, pool_cls=None, connection_cls=None):
-    @app.listener('before_server_start')
-    async def before_server_start(_, loop):
-        assert not hasattr(app, 'redis')
-        app.redis = await aioredis.create_redis_pool(
-            app.config.get('REDIS_URI') or
-            (app.config.get('REDIS_HOST', '127.0.0.1'),
-             app.config.get('REDIS_PORT', 6379)),
+    async def with_backoff(factory, *args, **kwargs):
+        delay = app.config.get('REDIS_RECONNECT_DELAY', 0.1)
+        max_delay = app.config.get('REDIS_RECONNECT_MAX_DELAY', 5)
+        attempts = app.config.get('REDIS_RECONNECT_ATTEMPTS', 8)
+        for attempt in range(1, attempts + 1):
+            try:
+                return await factory(*args, **kwargs)
+            except (OSError, asyncio.TimeoutError, aioredis.RedisError) as e:
+                if attempt == attempts:
+                    raise
+                logger.warning('Redis connection failed (%s), retrying in '
+                               '%.2fs', e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def make_pool_cls(base, name):
+        return pool_class(
+            base, name,
+            app.config.get('REDIS_RECONNECT_DELAY', 0.1),
+            app.config.get('REDIS_RECONNECT_MAX_DELAY', 5),
+            app.config.get('REDIS_METRICS', False))
+
+    async def create_sentinel(sentinels, loop):
+        pool = SentinelPool(
+            sentinels,
+            db=app.config.get('REDIS_DB'),
+            password=app.config.get('REDIS_PASSWORD'),
+            ssl=app.config.get('REDIS_SSL'),
+            encoding=app.config.get('REDIS_ENCODING'),
+            parser=parser,
+            minsize=app.config.get('REDIS_MINSIZE', 1),
+            maxsize=app.config.get('REDIS_MAXSIZE', 10),
+            timeout=app.config.get('REDIS_SENTINEL_TIMEOUT', 0.2),
+            loop=loop,
+            )
+        await pool.discover()
+        return RedisSentinel(pool)
+
+    async def create_master(service, name):
+        # the managed pool rediscovers the master through Sentinel whenever
+        # its connections drop, so a failover needs no pool rebuild here
+        redis = app.redis_sentinel.master_for(
+            service, make_pool_cls(ManagedPool, name))
+        await redis.ping()
+        return redis
+
+    async def create_pool(address, loop, name):
+        return await aioredis.create_redis_pool(
+            address,
             db=app.config.get('REDIS_DB'),
             password=app.config.get('REDIS_PASSWORD'),
             ssl=app.config.get('REDIS_SSL'),
@@ -19,14 +277,52 @@ def init_app(app: sanic.Sanic, *,
             maxsize=app.config.get('REDIS_MAXSIZE', 10),
             parser=parser,
             timeout=app.config.get('REDIS_CONNECT_TIMEOUT'),
-            pool_cls=pool_cls,
+            pool_cls=make_pool_cls(pool_cls or aioredis.ConnectionsPool, name),
             connection_cls=connection_cls,
             loop=loop,
             )
 
+    async def connect(address, loop, name='default'):
+        if getattr(app, 'redis_sentinel', None) is None:
+            rv = await with_backoff(create_pool, address, loop, name)
+        else:
+            rv = await with_backoff(create_master, address, name)
+        if app.config.get('REDIS_METRICS'):
+            rv = InstrumentedRedis(rv.connection, name)
+        return rv
+
+    @app.listener('before_server_start')
+    async def before_server_start(_, loop):
+        assert not hasattr(app, 'redis')
+        sentinels = app.config.get('REDIS_SENTINELS')
+        if sentinels:
+            app.redis_sentinel = await with_backoff(
+                create_sentinel, sentinels, loop)
+            address = app.config.get('REDIS_SENTINEL_MASTER', 'mymaster')
+        else:
+            address = app.config.get('REDIS_URI') or (
+                app.config.get('REDIS_HOST', '127.0.0.1'),
+                app.config.get('REDIS_PORT', 6379))
+        app.redis = await connect(address, loop)
+        shards = app.config.get('REDIS_SHARDS')
+        if shards:
+            nodes = {}
+            for address in shards:
+                name = address if isinstance(address, str) else \
+                    '%s:%s' % tuple(address)
+                nodes[name] = await connect(address, loop, name)
+            app.redis_shards = HashRing(
+                nodes, app.config.get('REDIS_SHARD_VNODES', 160))
+        for redis in {app.redis, *all_redis(app)}:
+            await load_scripts(redis)
+
     @app.listener('after_server_stop')
     async def after_server_stop(*_):
-        redis = getattr(app, 'redis', None)
-        if redis is not None:
-            redis.close()
-            await redis.wait_closed()
+        if getattr(app, 'redis', None) is not None:
+            for redis in {app.redis, *all_redis(app)}:
+                redis.close()
+                await redis.wait_closed()
+        sentinel = getattr(app, 'redis_sentinel', None)
+        if sentinel is not None:
+            sentinel.close()
+            await sentinel.wait_closed()
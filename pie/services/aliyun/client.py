@@ -0,0 +1,28 @@
+import aiohttp
+import sanic
+
+
+def init_app(app: sanic.Sanic):
+    @app.listener('before_server_start')
+    async def before_server_start(_, loop):
+        assert not hasattr(app, 'aliyun_http')
+        connector = aiohttp.TCPConnector(
+            limit=app.config.get('ALIYUN_HTTP_LIMIT', 100),
+            limit_per_host=app.config.get('ALIYUN_HTTP_LIMIT_PER_HOST', 20),
+            keepalive_timeout=app.config.get('ALIYUN_HTTP_KEEPALIVE', 60),
+            ttl_dns_cache=app.config.get('ALIYUN_HTTP_DNS_TTL', 300),
+            loop=loop,
+            )
+        app.aliyun_http = aiohttp.ClientSession(
+            connector=connector,
+            conn_timeout=app.config.get('ALIYUN_HTTP_CONNECT_TIMEOUT', 5),
+            read_timeout=app.config.get('ALIYUN_HTTP_READ_TIMEOUT', 10),
+            raise_for_status=True,
+            loop=loop,
+            )
+
+    @app.listener('after_server_stop')
+    async def after_server_stop(*_):
+        session = getattr(app, 'aliyun_http', None)
+        if session is not None:
+            await session.close()
@@ -1,6 +1,14 @@
+import asyncio
+import itertools
+import json
+import uuid
+
 import aiohttp
 from aliyunsdkcore.auth.composer.rpc_signature_composer import get_signed_url
 
+from ...circuit import get_breaker
+from ...utils import TokenBucket
+
 DEFAULT_REGION = 'cn-hangzhou'
 FIXTURE = {
     DEFAULT_REGION: dict(host='dm.aliyuncs.com', version='2015-11-23'),
@@ -9,33 +17,134 @@ FIXTURE = {
     'ap-southeast-2': dict(host='dm.ap-southeast-2.aliyuncs.com',
                            version='2017-06-22'),
 }
+RECEIVER_DETAIL_LIMIT = 100
+
+
+class DirectMailError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f'DirectMail rejected the request ({status}): '
+                         f'{message}')
+        self.status = status
+
+
+# only transport errors and 5xx replies count against the circuit, a 4xx
+# (e.g. an invalid recipient) is raised as DirectMailError instead
+breaker = get_breaker('aliyun_dm',
+                      errors=(aiohttp.ClientError, asyncio.TimeoutError))
+
+
+def _get_bucket(app):
+    rv = getattr(app, 'aliyun_dm_bucket', None)
+    if rv is None:
+        rate = app.config.get('ALIYUN_DM_RATE', 20)
+        rv = app.aliyun_dm_bucket = TokenBucket(
+            rate, app.config.get('ALIYUN_DM_BURST'))
+    return rv
 
 
-async def send_single(to_address, subject, text, html):
-    region = DEFAULT_REGION
+@breaker
+async def _request(app, action, **params):
+    region = app.config.get('ALIYUN_DM_REGION', DEFAULT_REGION)
     fixture = FIXTURE[region]
-    alias = 'PIE'
-    account = ''
-    ak_id = ''
-    ak_secret = ''
+    ak_id = app.config.get('ALIYUN_ACCESS_KEY_ID', '')
+    ak_secret = app.config.get('ALIYUN_ACCESS_KEY_SECRET', '')
 
     params = {
         'Version': fixture['version'],
         'RegionId': region,
 
-        'Action': 'SingleSendMail',
-        'AccountName': account,
-        'ReplyToAddress': True,
-        'AddressType': 0,
-        'ToAddress': to_address,
-        'FromAlias': alias,
-        'Subject': subject,
-        'HtmlBody': html,
-        'TextBody': text,
+        'Action': action,
+        **params,
     }
-    url = 'https://' + fixture['host'] + get_signed_url(
+    await _get_bucket(app).acquire()
+    # ALIYUN_DM_ENDPOINT points to a local stand-in of the API in tests
+    url = (app.config.get('ALIYUN_DM_ENDPOINT') or
+           'https://' + fixture['host']) + get_signed_url(
         params, ak_id, ak_secret, 'JSON',
         'GET', {})
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        async with session.get(url) as resp:
+    try:
+        async with app.aliyun_http.get(url) as resp:
             return await resp.json()
+    except aiohttp.ClientResponseError as e:
+        status = getattr(e, 'status', None) or e.code
+        if status < 500:
+            raise DirectMailError(status, e.message) from e
+        raise
+
+
+async def send_single(app, to_address, subject, text, html):
+    return await _request(
+        app, 'SingleSendMail',
+        AccountName=app.config.get('ALIYUN_DM_ACCOUNT', ''),
+        ReplyToAddress=True,
+        AddressType=0,
+        ToAddress=to_address,
+        FromAlias=app.config.get('ALIYUN_DM_ALIAS', 'PIE'),
+        Subject=subject,
+        HtmlBody=html,
+        TextBody=text,
+    )
+
+
+async def send_many(app, messages, *, concurrency=None, chunk_size=1000):
+    # (to_address, subject, text, html) messages, one result each in order
+    sem = asyncio.Semaphore(
+        concurrency or app.config.get('ALIYUN_DM_CONCURRENCY', 10))
+
+    async def send(message):
+        async with sem:
+            try:
+                result = await send_single(app, *message)
+            except Exception as e:
+                return dict(to_address=message[0], success=False,
+                            error=repr(e))
+            else:
+                return dict(to_address=message[0], success=True,
+                            result=result)
+
+    rv = []
+    messages = iter(messages)
+    while True:
+        chunk = list(itertools.islice(messages, chunk_size))
+        if not chunk:
+            break
+        rv.extend(await asyncio.gather(*[send(m) for m in chunk]))
+    return rv
+
+
+async def send_batch(app, template_name, recipients, *,
+                     receivers_name=None, tag_name=None):
+    # upload (email, data) recipients as a receiver list, one BatchSendMail
+    receivers_name = receivers_name or f'pie-{uuid.uuid4().hex[:16]}'
+    receiver = await _request(app, 'CreateReceiver',
+                              ReceiversName=receivers_name,
+                              ReceiversAlias=receivers_name)
+    rv = {}
+    recipients = iter(recipients)
+    while True:
+        chunk = list(itertools.islice(recipients, RECEIVER_DETAIL_LIMIT))
+        if not chunk:
+            break
+        result = await _request(
+            app, 'SaveReceiverDetail',
+            ReceiverId=receiver['ReceiverId'],
+            Detail=json.dumps([dict(Email=email, Data=json.dumps(data or {}))
+                               for email, data in chunk]))
+        failed = {item.get('Email') for item in
+                  result.get('Data', {}).get('Detail', [])}
+        for email, _ in chunk:
+            rv[email] = dict(to_address=email, success=email not in failed)
+    if any(item['success'] for item in rv.values()):
+        params = dict(
+            AccountName=app.config.get('ALIYUN_DM_ACCOUNT', ''),
+            AddressType=0,
+            TemplateName=template_name,
+            ReceiversName=receivers_name,
+        )
+        if tag_name:
+            params['TagName'] = tag_name
+        result = await _request(app, 'BatchSendMail', **params)
+        for item in rv.values():
+            if item['success']:
+                item['result'] = result
+    return list(rv.values())
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+import sanic
+from sqlalchemy import select, text
+
+from ..circuit import CircuitOpenError
+from ..db import db
+from ..metrics import registry
+from .aliyun.dm import DirectMailError, send_single
+
+logger = logging.getLogger(__name__)
+
+_PRUNE = '''\
+WITH batch AS (
+    SELECT id FROM email_outbox
+    WHERE status <> 'pending' AND created_at < :cutoff
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+DELETE FROM email_outbox USING batch WHERE email_outbox.id = batch.id
+'''
+
+
+class OutboxEmail(db.Model):
+    __tablename__ = 'email_outbox'
+
+    class Status:
+        pending = 'pending'
+        sent = 'sent'
+        dead = 'dead'
+
+    id = db.Column(db.BigInteger(), primary_key=True)
+    to_address = db.Column(db.Unicode(), nullable=False)
+    subject = db.Column(db.Unicode(), nullable=False)
+    text = db.Column(db.Unicode(), nullable=False, server_default='')
+    html = db.Column(db.Unicode(), nullable=False, server_default='')
+    status = db.Column(db.Unicode(), nullable=False,
+                       server_default=Status.pending)
+    attempts = db.Column(db.Integer(), nullable=False, server_default='0')
+    created_at = db.Column(db.DateTime(), nullable=False, index=True)
+    next_attempt_at = db.Column(db.DateTime(), nullable=False, index=True)
+    sent_at = db.Column(db.DateTime())
+    last_error = db.Column(db.Unicode())
+
+
+async def enqueue(to_address, subject, text='', html=''):
+    now = datetime.utcnow()
+    return await OutboxEmail.create(
+        to_address=to_address, subject=subject, text=text, html=html,
+        status=OutboxEmail.Status.pending, attempts=0, created_at=now,
+        next_attempt_at=now)
+
+
+async def claim(batch_size, lease):
+    now = datetime.utcnow()
+    ids = select([OutboxEmail.id]).where(
+        (OutboxEmail.status == OutboxEmail.Status.pending) &
+        (OutboxEmail.next_attempt_at <= now)
+    ).order_by(
+        OutboxEmail.next_attempt_at,
+    ).limit(batch_size).with_for_update(skip_locked=True)
+    # the lease keeps other workers away until this attempt is settled
+    return await OutboxEmail.update.values(
+        next_attempt_at=now + lease,
+        attempts=OutboxEmail.attempts + 1,
+    ).where(
+        OutboxEmail.id.in_(ids),
+    ).returning(*OutboxEmail).gino.load(OutboxEmail).all()
+
+
+async def prune(retention=timedelta(days=7), batch_size=500, pause=0.1):
+    cutoff = datetime.utcnow() - retention
+    rv = 0
+    while True:
+        status, _ = await db.status(text(_PRUNE), cutoff=cutoff,
+                                    batch_size=batch_size)
+        count = int(status.split()[-1])
+        rv += count
+        if count < batch_size:
+            break
+        await asyncio.sleep(pause)
+    registry.inc('mail_outbox_pruned_total', rv)
+    return rv
+
+
+class Worker:
+    def __init__(self, app: sanic.Sanic):
+        self._app = app
+        self.concurrency = app.config.get('MAIL_OUTBOX_CONCURRENCY', 8)
+        self.poll_interval = app.config.get('MAIL_OUTBOX_POLL_INTERVAL', 1)
+        self.lease = timedelta(
+            seconds=app.config.get('MAIL_OUTBOX_LEASE', 120))
+        self.max_attempts = app.config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 8)
+        self.backoff = app.config.get('MAIL_OUTBOX_BACKOFF', 5)
+        self.max_backoff = app.config.get('MAIL_OUTBOX_MAX_BACKOFF', 3600)
+
+    def _get_delay(self, attempts):
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+    async def deliver(self, email: OutboxEmail):
+        try:
+            await send_single(self._app, email.to_address, email.subject,
+                              email.text, email.html)
+        except asyncio.CancelledError:
+            raise
+        except CircuitOpenError as e:
+            # nothing was attempted, an outage must not use up the attempts
+            registry.inc('mail_outbox_total', status='deferred')
+            await email.update(
+                attempts=email.attempts - 1,
+                next_attempt_at=datetime.utcnow() + timedelta(
+                    seconds=e.breaker.reset_timeout *
+                    random.uniform(1, 1.5))).apply()
+        except Exception as e:
+            # a rejected request (4xx) will not succeed on retry either
+            if email.attempts >= self.max_attempts or \
+                    isinstance(e, DirectMailError):
+                logger.error('Giving up email %d to %s: %r', email.id,
+                             email.to_address, e)
+                registry.inc('mail_outbox_total', status='dead')
+                # settled rows keep no body, it may carry a login token
+                await email.update(status=OutboxEmail.Status.dead,
+                                   text='', html='',
+                                   last_error=repr(e)).apply()
+            else:
+                logger.warning('Failed to send email %d (attempt %d): %r',
+                               email.id, email.attempts, e)
+                registry.inc('mail_outbox_total', status='retry')
+                await email.update(
+                    next_attempt_at=datetime.utcnow() +
+                    self._get_delay(email.attempts),
+                    last_error=repr(e)).apply()
+        else:
+            registry.inc('mail_outbox_total', status='sent')
+            await email.update(status=OutboxEmail.Status.sent,
+                               text='', html='',
+                               sent_at=datetime.utcnow()).apply()
+
+    async def run_prune(self):
+        interval = self._app.config.get('MAIL_OUTBOX_PRUNE_INTERVAL', 3600)
+        retention = timedelta(seconds=self._app.config.get(
+            'MAIL_OUTBOX_RETENTION', 7 * 86400))
+        while True:
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            try:
+                count = await prune(retention)
+                logger.info('Pruned %d settled outbox emails', count)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to prune outbox emails')
+
+    async def run(self):
+        while True:
+            try:
+                emails = await claim(self.concurrency, self.lease)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to claim outbox emails')
+                emails = None
+            if emails:
+                # a row that failed to settle is retried once its lease ends
+                for rv in await asyncio.gather(
+                        *[self.deliver(email) for email in emails],
+                        return_exceptions=True):
+                    if isinstance(rv, Exception):
+                        logger.error('Failed to settle outbox email: %r', rv)
+            else:
+                await asyncio.sleep(
+                    self.poll_interval * random.uniform(0.5, 1.5))
+
+
+def init_app(app: sanic.Sanic):
+    @app.listener('after_server_start')
+    async def after_server_start(_, loop):
+        worker = Worker(app)
+        app.mail_outbox = [loop.create_task(worker.run()),
+                           loop.create_task(worker.run_prune())]
+
+    @app.listener('before_server_stop')
+    async def before_server_stop(*_):
+        for task in getattr(app, 'mail_outbox', ()):
+            task.cancel()
@@ -1,3 +1,4 @@
+import asyncio
 import time
 
 import sanic
@@ -25,6 +26,9 @@ class Session:
         self._using_cookie = using_cookie
         self._cookie_deadline = None
         self._should_refresh = False
+        self._preload = set()
+        self._pending = set()
+        self._fetching = None
 
     # noinspection PyMethodMayBeStatic
     def _sanitize_session_id(self, session_id: str) -> str:
@@ -53,6 +57,9 @@ class Session:
     async def _new_session_id(self) -> str:
         pass
 
+    async def _load_keys(self, keys) -> dict:
+        pass
+
     async def _save(self):
         pass
 
@@ -82,6 +89,32 @@ class Session:
             await self._loaded
         return self
 
+    async def fetch(self, *keys):
+        await self.load()
+        keys = self._pending.intersection(keys)
+        if keys:
+            if self._fetching is None:
+                self._fetching = set(), asyncio.ensure_future(
+                    self._fetch_pending())
+            self._fetching[0].update(keys)
+            await asyncio.shield(self._fetching[1])
+        return self
+
+    async def _fetch_pending(self):
+        # let concurrent fetch() calls of this request join the batch
+        await asyncio.sleep(0)
+        keys, _ = self._fetching
+        self._fetching = None
+        keys &= self._pending
+        if keys:
+            values = await self._load_keys(keys)
+            # keys set() meanwhile are no longer pending
+            keys &= self._pending
+            for key in keys:
+                if key in values:
+                    self._values[key] = values[key]
+            self._pending -= keys
+
     async def save(self, refresh=False):
         if not self._loaded:
             return
@@ -140,16 +173,19 @@ class Session:
 
     def get(self, key, default=None):
         assert self._loaded, 'Please load the session first.'
+        assert key not in self._pending, f'Please fetch {key!r} first.'
         return self._values.get(key, default)
 
     def set(self, key, value):
         assert self._loaded, 'Please load the session first.'
         self._values[key] = value
+        self._pending.discard(key)
         self._values_changed.add(key)
         self._to_del.discard(key)
 
     def pop(self, key, default=_no_default):
         assert self._loaded, 'Please load the session first.'
+        assert key not in self._pending, f'Please fetch {key!r} first.'
         if default is _no_default:
             rv = self._values.pop(key)
         else:
@@ -165,6 +201,8 @@ class Session:
 
     @classmethod
     def install(cls, app: sanic.Sanic):
+        app.session_cls = cls
+
         @app.middleware('response')
         async def on_response(request, response):
             session = cls.of(request, create=False)  # type: cls
@@ -172,7 +210,10 @@ class Session:
                 await session.on_response(response)
 
     @classmethod
-    def of(cls, request: Request, using_cookie=False, create=True):
+    def of(cls, request: Request, using_cookie=False, create=True, keys=()):
+        installed = getattr(request.app, 'session_cls', cls)
+        if installed is not cls and issubclass(installed, cls):
+            cls = installed
         rv = request.get(cls.key)
         if rv is None:
             if create:
@@ -180,6 +221,8 @@ class Session:
                 request[cls.key] = rv
         elif using_cookie:
             rv._using_cookie = True
+        if rv is not None:
+            rv._preload.update(keys)
         return rv
 
     def __init_subclass__(cls, **kwargs):
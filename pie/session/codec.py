@@ -0,0 +1,90 @@
+import json
+import zlib
+from datetime import datetime
+
+COMPRESSED = b'\x1f'
+COMPRESS_THRESHOLD = 1024
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+DECODERS = {
+    b'\x10': lambda data: data,
+    b'\x11': lambda data: data.decode('utf-8'),
+    b'\x12': lambda data: int(data),
+    b'\x13': lambda data: float(data),
+    b'\x14': lambda data: data in {b'1', b'yes', b'true', b'True'},
+}
+ENCODERS = {
+    bytes: (b'\x10', lambda data: data),
+    str: (b'\x11', lambda data: data.encode('utf-8')),
+    int: (b'\x12', lambda data: str(data).encode('utf-8')),
+    float: (b'\x13', lambda data: str(data).encode('utf-8')),
+    bool: (b'\x14', lambda data: b'1' if data else b'0'),
+}
+
+
+def register_codec(tag: bytes, types, encoder, decoder):
+    assert len(tag) == 1 and tag != COMPRESSED, f'Invalid tag {tag!r}.'
+    if isinstance(types, type):
+        types = (types,)
+    DECODERS[tag] = decoder
+    for type_ in types:
+        ENCODERS[type_] = tag, encoder
+
+
+def _check_json(data):
+    # only values that come back unchanged from JSON are accepted
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if not isinstance(key, str):
+                raise TypeError(f'Cannot encode dict key of type '
+                                f'{type(key)}, only str is supported.')
+            _check_json(value)
+    elif isinstance(data, list):
+        for value in data:
+            _check_json(value)
+    elif data is not None and not isinstance(data, (str, int, float)):
+        raise TypeError(f'Cannot encode nested value of type {type(data)}.')
+
+
+def _encode_json(data):
+    _check_json(data)
+    return json.dumps(data, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def _encode_datetime(data: datetime):
+    return data.strftime(_DATETIME_FORMAT + '%z').encode('utf-8')
+
+
+def _decode_datetime(data: bytes):
+    data = data.decode('utf-8')
+    if len(data) > 26:
+        return datetime.strptime(data, _DATETIME_FORMAT + '%z')
+    return datetime.strptime(data, _DATETIME_FORMAT)
+
+
+register_codec(b'\x15', type(None), lambda data: b'', lambda data: None)
+register_codec(b'\x16', (dict, list), _encode_json,
+               lambda data: json.loads(data.decode('utf-8')))
+register_codec(b'\x17', datetime, _encode_datetime, _decode_datetime)
+
+
+def encode_value(value) -> bytes:
+    for type_ in type(value).__mro__:
+        if type_ in ENCODERS:
+            tag, encoder = ENCODERS[type_]
+            break
+    else:
+        raise TypeError(f'Cannot encode value of type {type(value)}.')
+    rv = tag + encoder(value)
+    if len(rv) > COMPRESS_THRESHOLD:
+        compressed = COMPRESSED + zlib.compress(rv)
+        if len(compressed) < len(rv):
+            rv = compressed
+    return rv
+
+
+def decode_value(data: bytes):
+    if data[:1] == COMPRESSED:
+        data = zlib.decompress(data[1:])
+    return DECODERS[data[:1]](data[1:])
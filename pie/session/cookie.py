@@ -0,0 +1,129 @@
+import struct
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from . import redis
+from .codec import decode_value, encode_value
+
+
+class Session(redis.Session):
+    max_cookie_size = 3072
+    # seconds a cookie is trusted before revoke_all() is checked again
+    revoke_check_interval = 60
+
+    def __init__(self, request, using_cookie=False):
+        super().__init__(request, using_cookie)
+        self._in_cookie = False
+        self._checked_at = time.time()
+
+    def _get_fernets(self):
+        rv = getattr(self._app, 'session_cookie_fernets', None)
+        if rv is None:
+            keys = self._app.config.get('SESSION_COOKIE_KEYS')
+            assert keys, 'Please configure SESSION_COOKIE_KEYS.'
+            rv = self._app.session_cookie_fernets = [
+                Fernet(key) for key in keys]
+        return rv
+
+    def _sanitize_session_id(self, session_id):
+        self._in_cookie = False
+        if not session_id or len(session_id) == 64:
+            return super()._sanitize_session_id(session_id)
+        if len(session_id) > self.max_cookie_size:
+            return None
+        self._in_cookie = True
+        return session_id
+
+    @classmethod
+    def _revoked_ttl(cls):
+        # a cookie re-sealed just before its next check lives this long
+        return cls.ttl + cls.revoke_check_interval
+
+    def _pack(self, deadline):
+        rv = [struct.pack('!dd', deadline, self._checked_at)]
+        for key, value in self._values.items():
+            key = key.encode('utf-8')
+            value = encode_value(value)
+            rv.append(struct.pack('!HI', len(key), len(value)))
+            rv.append(key)
+            rv.append(value)
+        return b''.join(rv)
+
+    # noinspection PyMethodMayBeStatic
+    def _unpack(self, data):
+        deadline, checked_at = struct.unpack_from('!dd', data)
+        offset = 16
+        values = {}
+        while offset < len(data):
+            key_len, value_len = struct.unpack_from('!HI', data, offset)
+            offset += 6
+            key = data[offset:offset + key_len].decode('utf-8')
+            offset += key_len
+            values[key] = decode_value(data[offset:offset + value_len])
+            offset += value_len
+        return deadline, checked_at, values
+
+    async def _load(self):
+        if not self._in_cookie:
+            return await super()._load()
+        try:
+            token = self._session_id.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        for index, fernet in enumerate(self._get_fernets()):
+            try:
+                data = fernet.decrypt(token)
+            except InvalidToken:
+                continue
+            break
+        else:
+            return None
+        deadline, checked_at, values = self._unpack(data)
+        now = time.time()
+        if now >= deadline:
+            return None
+        checked = False
+        if self.index_key and values.get(self.index_key) is not None and \
+                now - checked_at >= self.revoke_check_interval:
+            revoked = await self._revoked_since(values[self.index_key])
+            if revoked is not None and revoked >= checked_at:
+                return None
+            checked_at = now
+            checked = True
+        self._checked_at = checked_at
+        # re-seal with the primary key if an old one was used
+        self._should_refresh = self._using_cookie and (
+            checked or index > 0 or
+            deadline - now < self.refresh_threshold)
+        return values
+
+    async def save(self, refresh=False):
+        if not self._loaded:
+            return
+        await self._loaded
+        if self._session_id and not self._in_cookie:
+            return await super().save(refresh)
+        if self._should_refresh:
+            refresh = True
+        if not (refresh or self._values_changed or self._to_del):
+            return
+        ts = self._get_deadline()
+        token = self._get_fernets()[0].encrypt(self._pack(ts)).decode('ascii')
+        self._values_changed.clear()
+        self._to_del.clear()
+        self._should_refresh = False
+        if len(token) <= self.max_cookie_size:
+            self._in_cookie = True
+            self._session_id = token
+            self._cookie_deadline = ts
+        else:
+            # too large for a cookie, move the whole session to Redis
+            self._in_cookie = False
+            self._values_changed.update(self._values)
+            self._session_id = await self._new_session()
+        return self._session_id
+
+    async def _destroy(self):
+        if not self._in_cookie:
+            await super()._destroy()
@@ -1,38 +1,25 @@
+import asyncio
 import binascii
-import functools
+import copy
 import hashlib
 import itertools
+import logging
 import os
 import time
 
 import aioredis
 
 from . import base
-from ..utils import retry_on
+from .codec import decode_value, encode_value
+from ..redis.aioredis import all_redis, get_redis, script
+from ..utils import LRUCache, retry_on
 
+logger = logging.getLogger(__name__)
 
 DATA = b'\x00'
 VALIDATOR = b'\x01'
 NONCE = b'\x02'
 NONCE_REPR = 'string.char(0x02)'
-DECODERS = {
-    b'\x10': lambda data: data,
-    b'\x11': lambda data: data.decode('utf-8'),
-    b'\x12': lambda data: int(data),
-    b'\x13': lambda data: float(data),
-    b'\x14': lambda data: data in {b'1', b'yes', b'true', b'True'},
-}
-ENCODERS = {
-    bytes: (b'\x10', lambda data: data),
-    str: (b'\x11', lambda data: data.encode('utf-8')),
-    int: (b'\x12', lambda data: str(data).encode('utf-8')),
-    float: (b'\x13', lambda data: str(data).encode('utf-8')),
-    bool: (b'\x14', lambda data: b'1' if data else b'0'),
-}
-
-
-class NoScriptError(aioredis.ReplyError):
-    MATCH_REPLY = 'NOSCRIPT'
 
 
 class RetryError(aioredis.ReplyError):
@@ -43,58 +30,249 @@ class ConcurrentUpdateError(aioredis.ReplyError):
     MATCH_REPLY = 'RACE Concurrent update'
 
 
-def script(m):
-    text = m(None)
-    sha1 = hashlib.sha1(text.encode('utf-8')).hexdigest()
-
-    # noinspection PyDefaultArgument
-    @functools.wraps(m)
-    async def wrapper(self, keys=[], args=[]):
-        try:
-            return await self._app.redis.evalsha(sha1, keys, args)
-        except NoScriptError:
-            return await self._app.redis.eval(text, keys, args)
-    return wrapper
+def _update_index(add, remove):
+    rv = f'''\
+    if (KEYS[{remove}] ~= '')
+    then
+        redis.call('SREM', KEYS[{remove}], KEYS[1])
+    end'''
+    if add:
+        rv += f'''
+    if (KEYS[{add}] ~= '')
+    then
+        redis.call('SADD', KEYS[{add}], KEYS[1])
+        local ttl = redis.call('PTTL', KEYS[1])
+        if (ttl > redis.call('PTTL', KEYS[{add}]))
+        then
+            redis.call('PEXPIRE', KEYS[{add}], ttl)
+        end
+    end'''
+    return rv
 
 
 class Session(base.Session):
     nonce_len = 8
+    cache_size = 0
+    cache_ttl = 1
+    cache_verify_nonce = True
+    # serve cache hits without any round trip, invalidated by keyspace
+    # notifications; needs notify-keyspace-events to include "Kghx"
+    cache_notify = False
+    cache_notify_retry = 1
+    _cache_notified = False
+    lazy = False
+    single_flight = False
+    index_key = 'uid'
 
     def __init__(self, request, using_cookie=False):
         super().__init__(request, using_cookie)
         self._nonce = None
+        self._indexed = None
 
     async def _load(self):
         selector, validator = self._split(self._session_id)
-        data = await self._app.redis.hgetall(selector)
-        deadline = float(data.get(validator, 0))
+        values, validators, nonce, pending = await self._fetch(selector)
+        deadline = validators.get(validator, 0)
         now = time.time()
         if now < deadline:
             should_refresh = self._using_cookie and \
                              deadline - now < self.refresh_threshold
-            rv = {}
-            for key, value in data.items():
-                key_type = key[:1]
-                if key_type == DATA:
-                    decoder = DECODERS.get(value[:1])
-                    rv[key[1:].decode('utf-8')] = decoder(value[1:])
-                elif key_type == VALIDATOR:
-                    value = float(value)
-                    if now > value:
-                        self._to_del.add(key)
-                    elif now + self.ttl - value < self.refresh_wait:
-                        should_refresh = False
-                elif key_type == NONCE:
-                    self._nonce = value
+            for key, value in validators.items():
+                if now > value:
+                    self._to_del.add(key)
+                elif now + self.ttl - value < self.refresh_wait:
+                    should_refresh = False
+            self._nonce = nonce
+            self._indexed = values.get(self.index_key)
+            self._pending = set(pending)
             self._should_refresh = should_refresh
-            return rv
+            # values may be shared with the cache or other requests
+            return copy.deepcopy(values)
+
+    @classmethod
+    def _get_cache(cls):
+        if not cls.cache_size:
+            return None
+        rv = cls.__dict__.get('_cache')
+        if rv is None:
+            rv = cls._cache = LRUCache(cls.cache_size, cls.cache_ttl)
+        return rv
+
+    async def _fetch(self, selector):
+        cache = self._get_cache()
+        if cache is not None:
+            rv = cache.get(selector)
+            if rv is not None and not rv[3].intersection(self._preload):
+                if self._cache_notified or not self.cache_verify_nonce:
+                    return rv
+                nonce = await self._get_redis(selector).hget(
+                    selector, NONCE)
+                if nonce == rv[2]:
+                    return rv
+                cache.pop(selector)
+        if self.single_flight:
+            rv = await self._fetch_shared(selector)
+        else:
+            rv = await self._fetch_remote(selector)
+        if cache is not None and rv[2] is not None:
+            cache.set(selector, rv)
+        return rv
+
+    @classmethod
+    async def _listen(cls, app):
+        cache = cls._get_cache()
+        pattern = f'__keyspace@*__:{cls.cookie_name}:*'
+        while True:
+            pools = all_redis(app)
+            tasks = []
+            try:
+                for redis in pools:
+                    for channel in await redis.psubscribe(pattern):
+                        tasks.append(asyncio.ensure_future(
+                            cls._drain(channel, cache)))
+                # entries cached before subscribing may have missed events
+                cache.clear()
+                cls._cache_notified = True
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                logger.warning('Session cache notifications interrupted')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Failed to subscribe to session keyspace '
+                               'notifications: %s', e)
+            finally:
+                cls._cache_notified = False
+                cache.clear()
+                for task in tasks:
+                    task.cancel()
+            for redis in pools:
+                try:
+                    await redis.punsubscribe(pattern)
+                except Exception:
+                    pass
+            await asyncio.sleep(cls.cache_notify_retry)
+
+    @staticmethod
+    async def _drain(channel, cache):
+        while await channel.wait_message():
+            name, _ = await channel.get()
+            cache.pop(name.split(b'__:', 1)[1])
+
+    @classmethod
+    def install(cls, app):
+        super().install(app)
+        if not (cls.cache_size and cls.cache_notify):
+            return
+
+        @app.listener('after_server_start')
+        async def after_server_start(_, loop):
+            app.session_cache_listener = loop.create_task(cls._listen(app))
+
+        @app.listener('before_server_stop')
+        async def before_server_stop(*_):
+            task = getattr(app, 'session_cache_listener', None)
+            if task is not None:
+                task.cancel()
+
+    async def _fetch_shared(self, selector):
+        inflight = self.__class__.__dict__.get('_inflight')
+        if inflight is None:
+            inflight = self.__class__._inflight = {}
+        key = selector, frozenset(self._preload) if self.lazy else None
+        fut = inflight.get(key)
+        if fut is None:
+            fut = inflight[key] = asyncio.ensure_future(
+                self._fetch_remote(selector))
+            fut.add_done_callback(
+                lambda _: inflight.get(key) is fut and inflight.pop(key))
+        return await asyncio.shield(fut)
+
+    async def _fetch_remote(self, selector):
+        if self.lazy:
+            fields = [DATA + key.encode('utf-8') for key in self._preload]
+            if self.index_key:
+                fields.append(DATA + self.index_key.encode('utf-8'))
+            # noinspection PyUnresolvedReferences
+            data = await self._load_lazy([selector], fields)
+            data = dict(zip(data[::2], data[1::2]))
+        else:
+            data = await self._get_redis(selector).hgetall(selector)
+        return self._decode(data)
+
+    # noinspection PyMethodMayBeStatic
+    def _decode(self, data):
+        values = {}
+        validators = {}
+        nonce = None
+        pending = set()
+        for key, value in data.items():
+            key_type = key[:1]
+            if key_type == DATA:
+                if value is None:
+                    pending.add(key[1:].decode('utf-8'))
+                else:
+                    values[key[1:].decode('utf-8')] = decode_value(value)
+            elif key_type == VALIDATOR:
+                validators[key] = float(value)
+            elif key_type == NONCE:
+                nonce = value
+        return values, validators, nonce, frozenset(pending)
+
+    @script
+    def _load_lazy(self):
+        return f'''\
+local wanted = {{}}
+for _, key in ipairs(ARGV) do
+    wanted[key] = true
+end
+local rv = {{}}
+local fields = {{}}
+for _, key in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if (string.byte(key) ~= {DATA[0]} or wanted[key])
+    then
+        fields[#fields + 1] = key
+    else
+        rv[#rv + 1] = key
+        rv[#rv + 1] = false
+    end
+end
+if (#fields > 0)
+then
+    local values = redis.call('HMGET', KEYS[1], unpack(fields))
+    for i, key in ipairs(fields) do
+        rv[#rv + 1] = key
+        rv[#rv + 1] = values[i]
+    end
+end
+return rv
+'''
+
+    async def _load_keys(self, keys):
+        selector, _ = self._split(self._session_id)
+        keys = list(keys)
+        data = await self._get_redis(selector).hmget(
+            selector, *[DATA + key.encode('utf-8') for key in keys])
+        rv = {}
+        for key, value in zip(keys, data):
+            if value is not None:
+                rv[key] = decode_value(value)
+        return rv
+
+    def _invalidate(self, selector):
+        cache = self._get_cache()
+        if cache is not None:
+            cache.pop(selector)
+        inflight = self.__class__.__dict__.get('_inflight')
+        if inflight:
+            # later loads must not join a read issued before this write
+            for key in [key for key in inflight if key[0] == selector]:
+                del inflight[key]
 
     def _encode(self, extra_values: dict=None) -> list:
         values = {}
         for key, value in self._values.items():
             if key in self._values_changed:
-                key_type, encoder = ENCODERS[type(value)]
-                values[DATA + key.encode('utf-8')] = key_type + encoder(value)
+                values[DATA + key.encode('utf-8')] = encode_value(value)
         if extra_values:
             values.update(extra_values)
         return list(itertools.chain.from_iterable(values.items()))
@@ -113,6 +291,69 @@ class Session(base.Session):
             rv.append(key)
         return rv
 
+    def _get_redis(self, selector):
+        return get_redis(self._app, selector)
+
+    @classmethod
+    def _index_name(cls, value):
+        return f'{cls.cookie_name}_{cls.index_key.upper()}:{value}'.encode(
+            'utf-8')
+
+    def _get_index(self):
+        if not self.index_key:
+            return None, b'', b''
+        value = self._values.get(self.index_key)
+        add = b'' if value is None else self._index_name(value)
+        remove = b''
+        if self._indexed is not None and self._indexed != value:
+            remove = self._index_name(self._indexed)
+        return value, add, remove
+
+    @classmethod
+    def _revoked_name(cls, value):
+        return f'{cls.cookie_name}_REVOKED_{cls.index_key.upper()}:' \
+               f'{value}'.encode('utf-8')
+
+    @classmethod
+    def _revoked_ttl(cls):
+        return cls.ttl
+
+    @classmethod
+    async def revoke_all(cls, app, value, batch=512):
+        installed = getattr(app, 'session_cls', cls)
+        if issubclass(installed, cls):
+            cls = installed
+        # sessions not stored in Redis (cookie backend) check this marker
+        revoked = cls._revoked_name(value)
+        await get_redis(app, revoked).set(
+            revoked, str(time.time()).encode('utf-8'),
+            expire=int(cls._revoked_ttl()))
+        index = cls._index_name(value)
+        cache = cls._get_cache()
+        rv = 0
+        for redis in all_redis(app):
+            cursor = None
+            while cursor != 0:
+                cursor, selectors = await redis.sscan(index, cursor or 0,
+                                                      count=batch)
+                if not selectors:
+                    continue
+                pipe = redis.pipeline()
+                deleted = pipe.delete(*selectors)
+                pipe.srem(index, *selectors)
+                await pipe.execute()
+                rv += await deleted
+                if cache is not None:
+                    for selector in selectors:
+                        cache.pop(selector)
+        return rv
+
+    async def _revoked_since(self, value):
+        revoked = self._revoked_name(value)
+        rv = await get_redis(self._app, revoked).get(revoked)
+        if rv is not None:
+            return float(rv)
+
     def _split(self, session_id):
         selector = self.cookie_name.encode('utf-8') + b':' + \
                    binascii.unhexlify(session_id[:32])
@@ -128,6 +369,7 @@ if (redis.call('EXISTS', KEYS[1]) == 0)
 then
     rv = redis.call('HMSET', KEYS[1], unpack(ARGV))
     redis.call('PEXPIREAT', KEYS[1], KEYS[2])
+{_update_index(3, 4)}
 else
     rv = {{err = '{RetryError.MATCH_REPLY}'}}
 end
@@ -140,10 +382,14 @@ return rv
         selector, validator = self._split(rv)
         new_nonce = self._make_nonce()
         ts = self._get_deadline()
+        indexed, add, remove = self._get_index()
         # noinspection PyUnresolvedReferences
-        await self._create_session([selector, int(ts * 1000)], self._encode(
-            {validator: str(ts).encode('utf-8'), NONCE: new_nonce}))
+        await self._create_session(
+            [selector, int(ts * 1000), add, remove],
+            self._encode({validator: str(ts).encode('utf-8'),
+                          NONCE: new_nonce}))
         self._nonce = new_nonce
+        self._indexed = indexed
         self._values_changed.clear()
         self._cookie_deadline = ts
         return rv
@@ -165,6 +411,7 @@ else
         redis.call('HDEL', KEYS[1], unpack(ARGV, 1, KEYS[5]))
     end
     redis.call('PEXPIREAT', KEYS[1], KEYS[4])
+{_update_index(7, 8)}
 end
 return rv
 '''
@@ -177,6 +424,8 @@ return rv
         new_nonce = self._make_nonce()
         to_del = self._get_del()
         ts = self._get_deadline()
+        indexed, add, remove = self._get_index()
+        self._invalidate(selector)
         # noinspection PyUnresolvedReferences
         await self._update_with_new_validator(
             [
@@ -186,9 +435,12 @@ return rv
                 int(ts * 1000),
                 len(to_del),
                 self._nonce,
+                add,
+                remove,
             ],
             to_del + self._encode({NONCE: new_nonce}))
         self._nonce = new_nonce
+        self._indexed = indexed
         self._to_del.clear()
         self._values_changed.clear()
         self._cookie_deadline = ts
@@ -207,6 +459,7 @@ else
     then
         redis.call('HDEL', KEYS[1], unpack(ARGV, 1, KEYS[3]))
     end
+{_update_index(4, 5)}
 end
 return rv
 '''
@@ -215,15 +468,20 @@ return rv
         selector, validator = self._split(self._session_id)
         new_nonce = self._make_nonce()
         to_del = self._get_del()
+        indexed, add, remove = self._get_index()
+        self._invalidate(selector)
         # noinspection PyUnresolvedReferences
         await self._do_save(
             [
                 selector,
                 self._nonce,
                 len(to_del),
+                add,
+                remove,
             ],
             to_del + self._encode({NONCE: new_nonce}))
         self._nonce = new_nonce
+        self._indexed = indexed
         self._to_del.clear()
         self._values_changed.clear()
 
@@ -236,11 +494,17 @@ then
     rv = {{err = '{ConcurrentUpdateError.MATCH_REPLY}'}}
 else
     rv = redis.call('DEL', KEYS[1])
+{_update_index(None, 3)}
 end
 return rv
 '''
 
     async def _destroy(self):
         selector, validator = self._split(self._session_id)
+        self._invalidate(selector)
+        remove = b''
+        if self.index_key and self._indexed is not None:
+            remove = self._index_name(self._indexed)
         # noinspection PyUnresolvedReferences
-        await self._do_destroy([selector, self._nonce])
+        await self._do_destroy([selector, self._nonce, remove])
+        self._indexed = None
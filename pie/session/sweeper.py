@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import random
+import time
+
+import sanic
+
+from ..metrics import registry
+from ..redis.aioredis import all_redis, script
+from .codec import decode_value
+from .redis import DATA, VALIDATOR, Session
+
+logger = logging.getLogger(__name__)
+
+
+class Sweeper:
+    def __init__(self, app: sanic.Sanic, session_cls=Session):
+        self._app = app
+        self._session_cls = session_cls
+        self.interval = app.config.get('SESSION_SWEEP_INTERVAL')
+        self.batch = app.config.get('SESSION_SWEEP_BATCH', 100)
+        self.pause = app.config.get('SESSION_SWEEP_PAUSE', 0.05)
+
+    @script
+    def _prune(self):
+        return f'''\
+local validators = {{}}
+for _, key in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if (string.byte(key) == {VALIDATOR[0]})
+    then
+        validators[#validators + 1] = key
+    end
+end
+if (#validators == 0)
+then
+    return {{0, ''}}
+end
+local now = tonumber(ARGV[1])
+local expired = {{}}
+local deadlines = redis.call('HMGET', KEYS[1], unpack(validators))
+for i, key in ipairs(validators) do
+    if (tonumber(deadlines[i]) < now)
+    then
+        expired[#expired + 1] = key
+    end
+end
+local indexed = ''
+if (#expired == #validators)
+then
+    if (ARGV[2] ~= '')
+    then
+        indexed = redis.call('HGET', KEYS[1], ARGV[2]) or ''
+    end
+    redis.call('DEL', KEYS[1])
+elseif (#expired > 0)
+then
+    redis.call('HDEL', KEYS[1], unpack(expired))
+end
+return {{#expired, indexed}}
+'''
+
+    async def sweep(self):
+        match = self._session_cls.cookie_name + ':*'
+        index_key = self._session_cls.index_key
+        index_field = DATA + index_key.encode('utf-8') if index_key else b''
+        rv = 0
+        for redis in all_redis(self._app):
+            cursor = None
+            while cursor != 0:
+                cursor, keys = await redis.scan(cursor or 0, match=match,
+                                                count=self.batch)
+                now = time.time()
+                # noinspection PyUnresolvedReferences
+                results = await asyncio.gather(
+                    *[self._prune([key], [now, index_field])
+                      for key in keys])
+                for key, (count, indexed) in zip(keys, results):
+                    rv += count
+                    if indexed:
+                        # the whole session is gone, drop it from the index
+                        await redis.srem(self._session_cls._index_name(
+                            decode_value(indexed)), key)
+                await asyncio.sleep(self.pause)
+        registry.inc('session_sweep_reclaimed_total', rv)
+        return rv
+
+    async def run(self):
+        lock = self._session_cls.cookie_name + '_SWEEP_LOCK'
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(0.5, 1.5))
+            # only one worker sweeps per interval
+            if not await self._app.redis.set(
+                    lock, b'1', pexpire=int(self.interval * 1000),
+                    exist=self._app.redis.SET_IF_NOT_EXIST):
+                continue
+            try:
+                start = time.monotonic()
+                reclaimed = await self.sweep()
+                logger.info('Reclaimed %d expired session validators in '
+                            '%.2fs', reclaimed, time.monotonic() - start)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to sweep sessions')
+
+
+def init_app(app: sanic.Sanic):
+    if not app.config.get('SESSION_SWEEP_INTERVAL'):
+        return
+
+    @app.listener('after_server_start')
+    async def after_server_start(_, loop):
+        sweeper = Sweeper(app, getattr(app, 'session_cls', Session))
+        app.session_sweeper = loop.create_task(sweeper.run())
+
+    @app.listener('before_server_stop')
+    async def before_server_stop(*_):
+        task = getattr(app, 'session_sweeper', None)
+        if task is not None:
+            task.cancel()
@@ -1,15 +1,133 @@
+import asyncio
+import collections
 import functools
+import random
+import time
 
+retry_attempts = collections.Counter()
+retry_hooks = []
 
-def retry_on(error: type, *, times=2):
+
+class RetryBudget:
+    def __init__(self, ratio=0.1, max_retries=10):
+        self.ratio = ratio
+        self.max_retries = max_retries
+        self._balance = max_retries
+
+    def deposit(self):
+        self._balance = min(self._balance + self.ratio, self.max_retries)
+
+    def withdraw(self):
+        if self._balance >= 1:
+            self._balance -= 1
+            return True
+        return False
+
+
+def retry_on(error: type, *, times=2, backoff=0, max_backoff=None,
+             jitter=True, deadline=None, budget: RetryBudget=None):
     def decorator(m):
+        name = f'{m.__module__}.{m.__qualname__}'
+
         @functools.wraps(m)
         async def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            if budget is not None:
+                budget.deposit()
             for count in range(times):
                 try:
                     return await m(*args, **kwargs)
-                except error:
+                except error as e:
                     if count == times - 1:
                         raise
+                    delay = backoff * 2 ** count
+                    if max_backoff is not None:
+                        delay = min(delay, max_backoff)
+                    if jitter:
+                        delay = random.uniform(0, delay)
+                    if deadline is not None and \
+                            time.monotonic() - start + delay > deadline:
+                        raise
+                    if budget is not None and not budget.withdraw():
+                        raise
+                    retry_attempts[name] += 1
+                    for hook in retry_hooks:
+                        hook(name, count + 1, e)
+                    if delay:
+                        await asyncio.sleep(delay)
         return wrapper
     return decorator
+
+
+class LRUCache:
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            deadline, value = self._data[key]
+        except KeyError:
+            return default
+        if deadline is not None and deadline < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        deadline = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = deadline, value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        rv = self._data.pop(key, None)
+        if rv is None:
+            return default
+        return rv[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        if capacity is None:
+            # a bucket must hold at least one token to ever grant one
+            capacity = max(rate, 1)
+        if rate <= 0 or capacity <= 0:
+            raise ValueError(f'Invalid token bucket rate {rate!r} or '
+                             f'capacity {capacity!r}.')
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self, tokens=1):
+        if tokens > self.capacity:
+            raise ValueError(f'Cannot acquire {tokens} tokens from a bucket '
+                             f'of capacity {self.capacity}.')
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
@@ -14,11 +14,13 @@ setuptools.setup(
     packages=setuptools.find_packages(),
 
     install_requires=[
+        'aiocontextvars==0.2.2;python_version<"3.7"',
         'aiohttp==2.3.7',
-        'aioredis==1.0.0',
+        'aioredis==1.1.0',
         'alembic==0.9.6',
         'aliyun-python-sdk-core-v3==2.8.6',
-        'argon2-cffi==16.3.0',
+        'argon2-cffi==18.2.0',
+        'cryptography==2.1.4',
         'gino',
         'psycopg2==2.7.3.2',
         'sanic==0.7.0',
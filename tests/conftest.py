@@ -0,0 +1,99 @@
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RedisProcess:
+    def __init__(self, *args, sentinel=False):
+        self.port = free_port()
+        self.dir = tempfile.mkdtemp()
+        self._args = args
+        self._sentinel = sentinel
+        self._proc = None
+        self.start()
+
+    def start(self):
+        if self._sentinel:
+            conf = os.path.join(self.dir, 'sentinel.conf')
+            with open(conf, 'w') as f:
+                f.write(f'port {self.port}\n')
+                f.write('\n'.join(self._args) + '\n')
+            cmd = ['redis-server', conf, '--sentinel']
+        else:
+            cmd = ['redis-server', '--port', str(self.port), '--save', '',
+                   '--appendonly', 'no', '--dir', self.dir, *self._args]
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 0.1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc = None
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+@pytest.fixture
+def redis_process():
+    pytest.importorskip('aioredis')
+    pytest.importorskip('sanic')
+    if shutil.which('redis-server') is None:
+        pytest.skip('redis-server is not available')
+    processes = []
+
+    def factory(*args, **kwargs):
+        rv = RedisProcess(*args, **kwargs)
+        processes.append(rv)
+        return rv
+
+    yield factory
+    for process in processes:
+        process.close()
+
+
+@pytest.fixture
+def redis_server(redis_process):
+    return redis_process()
+
+
+@pytest.fixture
+def loop():
+    rv = asyncio.new_event_loop()
+    asyncio.set_event_loop(rv)
+    yield rv
+    rv.close()
+    asyncio.set_event_loop(None)
+
+
+async def start_app(app, loop):
+    for listener in app.listeners['before_server_start']:
+        await listener(app, loop)
+
+
+async def stop_app(app, loop):
+    for listener in reversed(app.listeners['after_server_stop']):
+        await listener(app, loop)
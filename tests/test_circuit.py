@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+circuit = pytest.importorskip('pie.circuit')
+
+
+class Failure(Exception):
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    return now
+
+
+def make_breaker(**config):
+    rv = circuit.CircuitBreaker('test', errors=(Failure,), **config)
+
+    @rv
+    async def call(error=None):
+        if error is not None:
+            raise error
+        return 'ok'
+
+    return rv, call
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_opens_on_failure_ratio(clock):
+    breaker, call = make_breaker(min_calls=4, failure_ratio=0.5)
+    run(call())
+    run(call())
+    for _ in range(2):
+        with pytest.raises(Failure):
+            run(call(Failure()))
+    assert breaker.state == circuit.OPEN
+    with pytest.raises(circuit.CircuitOpenError):
+        run(call())
+
+
+def test_other_errors_are_not_failures(clock):
+    breaker, call = make_breaker(min_calls=2)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            run(call(ValueError()))
+    assert breaker.state == circuit.CLOSED
+
+
+def test_window_forgets_old_failures(clock):
+    breaker, call = make_breaker(min_calls=3, window=10)
+    for _ in range(2):
+        with pytest.raises(Failure):
+            run(call(Failure()))
+    clock[0] += 11
+    run(call())
+    assert breaker.state == circuit.CLOSED
+
+
+def test_half_open(clock):
+    breaker, call = make_breaker(min_calls=1, reset_timeout=5)
+    with pytest.raises(Failure):
+        run(call(Failure()))
+    assert breaker.state == circuit.OPEN
+
+    clock[0] += 6
+    with pytest.raises(Failure):
+        run(call(Failure()))
+    # the failed trial opened it again
+    assert breaker.state == circuit.OPEN
+
+    clock[0] += 6
+    assert run(call()) == 'ok'
+    assert breaker.state == circuit.CLOSED
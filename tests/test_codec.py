@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from pie.session.codec import (COMPRESS_THRESHOLD, COMPRESSED, decode_value,
+                               encode_value)
+
+
+@pytest.mark.parametrize('value', [
+    b'\x00raw', 'text', '', 42, -1, 1.5, True, False, None,
+    {'a': 1, 'b': [1, 'x', None, {'c': 2.5}]}, [], {},
+    datetime(2018, 1, 2, 3, 4, 5, 6),
+    datetime(2018, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+])
+def test_round_trip(value):
+    rv = decode_value(encode_value(value))
+    assert rv == value
+    assert type(rv) is type(value)
+
+
+def test_compression():
+    value = 'x' * COMPRESS_THRESHOLD * 2
+    data = encode_value(value)
+    assert data[:1] == COMPRESSED
+    assert len(data) < COMPRESS_THRESHOLD
+    assert decode_value(data) == value
+
+    small = encode_value('x' * 10)
+    assert small[:1] != COMPRESSED
+
+
+@pytest.mark.parametrize('value', [
+    (1, 2),
+    {1: 'a'},
+    {'a': (1, 2)},
+    {'when': datetime(2018, 1, 1)},
+    [b'bytes'],
+    object(),
+])
+def test_rejects_lossy_values(value):
+    with pytest.raises(TypeError):
+        encode_value(value)
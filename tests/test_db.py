@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+db = pytest.importorskip('pie.db')
+sa = pytest.importorskip('sqlalchemy')
+
+table = sa.table('t', sa.column('a'))
+
+
+class Transaction:
+    def __await__(self):
+        return self._begin().__await__()
+
+    async def _begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class Engine:
+    def __init__(self, name):
+        self.name = name
+
+    async def all(self, clause, *multiparams, **params):
+        return self.name
+
+    first = scalar = status = all
+
+    def transaction(self):
+        return Transaction()
+
+
+@pytest.fixture
+def engine():
+    replica = db.Replica('test', Engine('replica'))
+    replica.healthy = True
+    return db.RoutingEngine(Engine('primary'), [replica])
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_reads_go_to_replicas(engine):
+    async def m():
+        assert await engine.all(sa.select([table.c.a])) == 'replica'
+        assert await engine.all(
+            sa.select([table.c.a]).with_for_update()) == 'primary'
+        assert await engine.status(table.update().values(a=1)) == 'primary'
+        assert await engine.status(sa.text('SELECT 1')) == 'primary'
+        with db.reads_from(db.PRIMARY):
+            assert await engine.all(sa.select([table.c.a])) == 'primary'
+    run(m())
+
+
+def test_forcing_replica_keeps_writes_on_primary(engine):
+    async def m():
+        with db.reads_from(db.REPLICA):
+            assert await engine.status(
+                table.update().values(a=1)) == 'primary'
+            assert await engine.all(
+                sa.select([table.c.a]).with_for_update()) == 'primary'
+            async with engine.transaction():
+                assert await engine.all(sa.select([table.c.a])) == 'primary'
+            assert await engine.all(sa.select([table.c.a])) == 'replica'
+    run(m())
+
+
+def test_transactions_stay_on_primary(engine):
+    async def m():
+        calls = []
+
+        async def callback():
+            calls.append(None)
+
+        async with engine.transaction():
+            assert await engine.all(sa.select([table.c.a])) == 'primary'
+            await db.after_commit(callback)
+            assert not calls
+        assert calls
+
+        tx = await engine.transaction()
+        assert await engine.all(sa.select([table.c.a])) == 'primary'
+        await db.after_commit(callback)
+        await tx.rollback()
+        assert len(calls) == 1
+        assert await engine.all(sa.select([table.c.a])) == 'replica'
+
+        tx = await engine.transaction()
+        await db.after_commit(callback)
+        await tx.commit()
+        assert len(calls) == 2
+    run(m())
+
+
+def test_unhealthy_replica_falls_back(engine):
+    engine.replicas[0].healthy = False
+    assert run(engine.all(sa.select([table.c.a]))) == 'primary'
+
+
+def test_only_writes_pin_the_request(engine):
+    async def m():
+        state = dict(pinned=False, wrote=False)
+        db._request_state.set(state)
+        async with engine.transaction():
+            await engine.all(sa.select([table.c.a]))
+        assert not state['wrote']
+        assert await engine.all(sa.select([table.c.a])) == 'replica'
+        async with engine.transaction():
+            await engine.status(table.update().values(a=1))
+        assert state['wrote']
+        assert await engine.all(sa.select([table.c.a])) == 'primary'
+    run(m())
+
+
+def test_after_commit_without_replicas():
+    engine = db.TransactionEngine(Engine('primary'))
+
+    async def m():
+        calls = []
+
+        async def callback():
+            calls.append(None)
+
+        async with engine.transaction():
+            assert await engine.all(sa.select([table.c.a])) == 'primary'
+            await db.after_commit(callback)
+            assert not calls
+        assert calls
+    run(m())
+
+
+def test_primary_failures_open_the_breaker(monkeypatch):
+    from pie.circuit import CircuitBreaker, CircuitOpenError
+
+    calls = []
+
+    class Down(Engine):
+        async def all(self, clause, *multiparams, **params):
+            calls.append(clause)
+            raise OSError()
+
+    monkeypatch.setattr(db, 'breaker', CircuitBreaker(
+        'test_db', errors=(OSError,), min_calls=1))
+    engine = db.TransactionEngine(Down('primary'))
+    with pytest.raises(OSError):
+        run(engine.all(sa.select([table.c.a])))
+    with pytest.raises(CircuitOpenError):
+        run(engine.all(sa.select([table.c.a])))
+    assert len(calls) == 1
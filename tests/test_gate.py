@@ -0,0 +1,86 @@
+import types
+
+from .conftest import start_app, stop_app
+
+TOKEN = 'a' * 32 + 'b' * 32
+FORGED = 'a' * 32 + 'c' * 32
+
+
+def make_gate(redis_server, **config):
+    import sanic
+    from pie.auth.gate import TokenGate
+    from pie.redis.aioredis import init_app
+
+    app = sanic.Sanic('test_gate')
+    app.config.update(REDIS_PORT=redis_server.port, **config)
+    init_app(app)
+    return app, TokenGate(app)
+
+
+def request(ip='10.0.0.1'):
+    return types.SimpleNamespace(ip=ip)
+
+
+def run(loop, app, m):
+    async def wrapper():
+        await start_app(app, loop)
+        try:
+            await m()
+        finally:
+            await stop_app(app, loop)
+    loop.run_until_complete(wrapper())
+
+
+def test_rejected_token_is_known_bad(loop, redis_server):
+    from pie.auth import gate
+    app, token_gate = make_gate(redis_server)
+
+    async def m():
+        assert await token_gate.check(request(), TOKEN) == gate.ALLOWED
+        await token_gate.reject(request(), TOKEN)
+        assert await token_gate.check(request(), TOKEN) == gate.KNOWN_BAD
+        assert await token_gate.check(request('10.0.0.2'), TOKEN) == \
+            gate.KNOWN_BAD
+
+    run(loop, app, m)
+
+
+def test_forged_validator_does_not_block_real_token(loop, redis_server):
+    from pie.auth import gate
+    app, token_gate = make_gate(redis_server)
+
+    async def m():
+        await token_gate.reject(request('10.0.0.2'), FORGED)
+        assert await token_gate.check(request(), FORGED) == gate.KNOWN_BAD
+        assert await token_gate.check(request(), TOKEN) == gate.ALLOWED
+
+    run(loop, app, m)
+
+
+def test_ip_limit(loop, redis_server):
+    from pie.auth import gate
+    app, token_gate = make_gate(redis_server, TOKEN_GATE_IP_LIMIT=3)
+
+    async def m():
+        for i in range(3):
+            token = f'{i:064x}'
+            assert await token_gate.check(request(), token) == gate.ALLOWED
+            await token_gate.reject(request(), token)
+        assert await token_gate.check(request(), TOKEN) == \
+            gate.TOO_MANY_FAILURES
+        assert await token_gate.check(request('10.0.0.2'), TOKEN) == \
+            gate.ALLOWED
+
+    run(loop, app, m)
+
+
+def test_burn_does_not_count_against_ip(loop, redis_server):
+    from pie.auth import gate
+    app, token_gate = make_gate(redis_server, TOKEN_GATE_IP_LIMIT=1)
+
+    async def m():
+        await token_gate.burn(request(), TOKEN)
+        assert await token_gate.check(request(), TOKEN) == gate.KNOWN_BAD
+        assert await token_gate.check(request(), FORGED) == gate.ALLOWED
+
+    run(loop, app, m)
@@ -0,0 +1,19 @@
+import pytest
+
+hashing = pytest.importorskip('pie.auth.hashing')
+
+
+def test_hash_and_rehash(loop):
+    hasher = hashing.Hasher(time_cost=1, memory_cost=64, parallelism=1,
+                            executor='thread', workers=1)
+    try:
+        hash_ = loop.run_until_complete(hasher.hash('secret'))
+        assert loop.run_until_complete(hasher.verify(hash_, 'secret'))
+        assert not loop.run_until_complete(hasher.verify(hash_, 'wrong'))
+        assert not hasher.needs_rehash(hash_)
+        stronger = hashing.Hasher(time_cost=2, memory_cost=64,
+                                  parallelism=1, executor='thread')
+        assert stronger.needs_rehash(hash_)
+        stronger.close()
+    finally:
+        hasher.close()
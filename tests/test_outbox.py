@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from .conftest import free_port, start_app, stop_app
+
+web = pytest.importorskip('aiohttp.web')
+pytest.importorskip('aliyunsdkcore')
+outbox = pytest.importorskip('pie.services.outbox')
+
+
+class Row:
+    """Stands in for a claimed OutboxEmail row, recording its updates."""
+
+    def __init__(self, attempts=1):
+        self.id = 1
+        self.to_address = 'user@example.com'
+        self.subject = 'Login'
+        self.text = ''
+        self.html = '<a href="https://example.com/auth/token/secret">go</a>'
+        self.status = outbox.OutboxEmail.Status.pending
+        self.attempts = attempts
+        self.last_error = None
+
+    def update(self, **values):
+        row = self
+
+        class Request:
+            async def apply(self):
+                row.__dict__.update(values)
+
+        return Request()
+
+
+@pytest.fixture
+def dm(loop):
+    import sanic
+    from pie.services.aliyun.client import init_app
+
+    replies = []
+    requests = []
+
+    async def handler(request):
+        requests.append(dict(request.query))
+        status = replies.pop(0) if replies else 200
+        return web.json_response(dict(EnvId='1'), status=status)
+
+    stub = web.Application()
+    stub.router.add_get('/', handler)
+    port = free_port()
+    handler_factory = stub.make_handler()
+    server = loop.run_until_complete(
+        loop.create_server(handler_factory, '127.0.0.1', port))
+
+    app = sanic.Sanic('test_outbox')
+    app.config.update(ALIYUN_DM_ENDPOINT=f'http://127.0.0.1:{port}',
+                      MAIL_OUTBOX_MAX_ATTEMPTS=3)
+    init_app(app)
+    loop.run_until_complete(start_app(app, loop))
+    yield app, replies, requests
+    loop.run_until_complete(stop_app(app, loop))
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.run_until_complete(handler_factory.shutdown())
+
+
+def test_sent_row_drops_body(loop, dm):
+    app, replies, requests = dm
+    row = Row()
+    loop.run_until_complete(outbox.Worker(app).deliver(row))
+    assert requests[0]['Action'] == 'SingleSendMail'
+    assert requests[0]['ToAddress'] == 'user@example.com'
+    assert row.status == outbox.OutboxEmail.Status.sent
+    assert row.html == row.text == ''
+
+
+def test_failure_is_retried(loop, dm):
+    app, replies, requests = dm
+    replies.append(503)
+    row = Row()
+    loop.run_until_complete(outbox.Worker(app).deliver(row))
+    assert row.status == outbox.OutboxEmail.Status.pending
+    assert row.last_error
+    assert row.html
+
+
+def test_last_attempt_is_dead_lettered(loop, dm):
+    app, replies, requests = dm
+    replies.append(503)
+    row = Row(attempts=3)
+    loop.run_until_complete(outbox.Worker(app).deliver(row))
+    assert row.status == outbox.OutboxEmail.Status.dead
+    assert row.html == row.text == ''
+
+
+def test_client_errors_do_not_trip_the_circuit(loop, dm):
+    from pie.services.aliyun.dm import breaker
+
+    app, replies, requests = dm
+    replies.append(400)
+    failures = breaker._failures
+    row = Row()
+    loop.run_until_complete(outbox.Worker(app).deliver(row))
+    assert 'DirectMailError' in row.last_error
+    assert row.status == outbox.OutboxEmail.Status.dead
+    assert breaker._failures == failures
+
+
+def test_open_circuit_does_not_use_attempts(loop, dm):
+    from pie.circuit import CLOSED
+    from pie.services.aliyun.dm import breaker
+
+    app, replies, requests = dm
+    row = Row(attempts=3)
+    breaker._open(time.monotonic())
+    try:
+        loop.run_until_complete(outbox.Worker(app).deliver(row))
+    finally:
+        breaker._set_state(CLOSED)
+    assert not requests
+    assert row.status == outbox.OutboxEmail.Status.pending
+    assert row.attempts == 2
@@ -0,0 +1,61 @@
+import types
+
+import pytest
+
+from .conftest import start_app, stop_app
+
+ratelimit = pytest.importorskip('pie.ratelimit')
+
+
+def make_app(**config):
+    return types.SimpleNamespace(config=config)
+
+
+def test_default_capacity():
+    assert ratelimit.Bucket('a', rate=5).capacity == 5
+    assert ratelimit.Bucket('a', rate=0.5).capacity == 1
+    assert ratelimit.Bucket('a', rate=0.5, capacity=3).capacity == 3
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        ratelimit.Bucket('a', rate=0)
+    with pytest.raises(ValueError):
+        ratelimit.Bucket('a', rate=1, capacity=0.5)
+
+
+def test_config_overrides():
+    bucket = ratelimit.Bucket('a', rate=1, capacity=2)
+    assert bucket.get_limits(make_app()) == (1, 2)
+    assert bucket.get_limits(make_app(RATE_LIMITS=dict(a=(3, 4)))) == (3, 4)
+    assert bucket.get_limits(make_app(RATE_LIMITS=dict(a=0.2))) == (0.2, 1)
+    with pytest.raises(ValueError):
+        bucket.get_limits(make_app(RATE_LIMITS=dict(a=(1, 0.5))))
+
+
+def test_acquire(loop, redis_server):
+    import sanic
+    from pie.redis.aioredis import init_app
+
+    app = sanic.Sanic('test_ratelimit')
+    app.config.update(REDIS_PORT=redis_server.port)
+    init_app(app)
+    request = types.SimpleNamespace(ip='10.0.0.1')
+    slow = ratelimit.Bucket('slow', ratelimit.per_ip, rate=0.5)
+    burst = ratelimit.Bucket('burst', rate=1, capacity=2)
+
+    async def run():
+        await start_app(app, loop)
+        try:
+            assert await ratelimit.acquire(app, request, [slow]) == 0
+            assert await ratelimit.acquire(app, request, [slow]) > 1
+
+            assert await ratelimit.acquire(app, request, [burst]) == 0
+            assert await ratelimit.acquire(app, request, [burst]) == 0
+            assert await ratelimit.acquire(app, request, [burst]) > 0
+            with pytest.raises(ValueError):
+                await ratelimit.acquire(app, request, [burst], cost=3)
+        finally:
+            await stop_app(app, loop)
+
+    loop.run_until_complete(run())
@@ -0,0 +1,132 @@
+import asyncio
+import collections
+
+import pytest
+
+from .conftest import start_app, stop_app
+
+
+def make_app(**config):
+    import sanic
+    from pie.redis.aioredis import init_app
+
+    app = sanic.Sanic('test_redis')
+    app.config.update(config)
+    init_app(app)
+    return app
+
+
+async def retry(m, timeout):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while True:
+        try:
+            return await m()
+        except Exception:
+            if asyncio.get_event_loop().time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def test_reconnect_backoff(loop, redis_server):
+    app = make_app(REDIS_PORT=redis_server.port,
+                   REDIS_RECONNECT_DELAY=0.2,
+                   REDIS_RECONNECT_MAX_DELAY=0.4)
+
+    async def run():
+        await start_app(app, loop)
+        try:
+            await app.redis.set('key', 'value')
+            redis_server.stop()
+            start = loop.time()
+            failures = 0
+            # the 1st failure is the dropped connection itself
+            while failures < 4:
+                try:
+                    await app.redis.get('key')
+                except Exception:
+                    failures += 1
+            # the 2nd and 3rd reconnects waited for the backoff
+            assert loop.time() - start >= 0.2 + 0.4
+
+            redis_server.start()
+            await asyncio.sleep(0.4)
+            await app.redis.set('key', 'back')
+            assert await app.redis.get('key') == b'back'
+        finally:
+            await stop_app(app, loop)
+
+    loop.run_until_complete(run())
+
+
+def test_metrics(loop, redis_server):
+    from pie.metrics import registry
+
+    app = make_app(REDIS_PORT=redis_server.port, REDIS_METRICS=True)
+
+    async def run():
+        await start_app(app, loop)
+        try:
+            await app.redis.set('key', 'value')
+            with await app.redis as conn:
+                assert await conn.get('key') == b'value'
+        finally:
+            await stop_app(app, loop)
+
+    loop.run_until_complete(run())
+    labels = (('pool', 'default'),)
+    assert registry.histograms['redis_pool_wait_seconds', labels].count
+    assert registry.histograms['redis_command_seconds', (
+        ('command', 'SET'), ('pool', 'default'))].count
+    assert registry.gauges['redis_pool_maxsize', labels]() == 10
+
+
+def test_sentinel_failover(loop, redis_process):
+    master = redis_process()
+    redis_process('--slaveof', '127.0.0.1', str(master.port))
+    sentinel = redis_process(
+        f'sentinel monitor pie 127.0.0.1 {master.port} 1',
+        'sentinel down-after-milliseconds pie 500',
+        'sentinel failover-timeout pie 2000',
+        sentinel=True)
+    app = make_app(REDIS_SENTINELS=[('127.0.0.1', sentinel.port)],
+                   REDIS_SENTINEL_MASTER='pie',
+                   REDIS_METRICS=True,
+                   REDIS_RECONNECT_DELAY=0.05,
+                   REDIS_RECONNECT_MAX_DELAY=0.5)
+
+    async def replica_known():
+        assert await app.redis_sentinel.slaves('pie')
+
+    async def write():
+        await app.redis.set('key', 'after')
+
+    async def run():
+        await start_app(app, loop)
+        try:
+            await app.redis.set('key', 'before')
+            await retry(replica_known, 15)
+            master.stop()
+            await retry(write, 30)
+            assert await app.redis.get('key') == b'after'
+            assert app.redis.connection.address[1] != master.port
+        finally:
+            await stop_app(app, loop)
+
+    loop.run_until_complete(run())
+
+
+def test_hash_ring():
+    HashRing = pytest.importorskip('pie.redis.aioredis').HashRing
+    ring = HashRing({'a': 'A', 'b': 'B', 'c': 'C'})
+    keys = [f'key{i}'.encode() for i in range(3000)]
+    placement = {key: ring.get(key) for key in keys}
+    assert placement == {key: ring.get(key) for key in keys}
+    counts = collections.Counter(placement.values())
+    assert set(counts) == {'A', 'B', 'C'}
+    assert min(counts.values()) > 600
+
+    # adding a node only moves keys onto the new node
+    bigger = HashRing({'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'})
+    moved = [key for key in keys if bigger.get(key) != placement[key]]
+    assert all(bigger.get(key) == 'D' for key in moved)
+    assert len(moved) < len(keys) / 2
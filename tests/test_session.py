@@ -0,0 +1,231 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from .conftest import start_app, stop_app
+
+cookie = pytest.importorskip('pie.session.cookie')
+redis = pytest.importorskip('pie.session.redis')
+
+
+def make_session(values):
+    rv = cookie.Session.__new__(cookie.Session)
+    rv._values = values
+    rv._checked_at = 1514862000.25
+    return rv
+
+
+@pytest.mark.parametrize('values', [
+    {},
+    {'uid': 42},
+    {'uid': 42, 'name': 'ünïcode', 'raw': b'\x00\xff', 'flag': False,
+     'profile': {'a': [1, None]}, 'when': datetime(2018, 1, 2, 3, 4, 5)},
+    {'big': 'x' * 5000},
+])
+def test_pack_round_trip(values):
+    session = make_session(values)
+    data = session._pack(1514862245.5)
+    assert session._unpack(data) == (1514862245.5, 1514862000.25, values)
+
+
+def test_pack_is_compact():
+    session = make_session({'uid': 42})
+    # deadline, check time, one header, the key and the tagged value
+    assert len(session._pack(0)) == 16 + 6 + 3 + 3
+
+
+class Request(dict):
+    def __init__(self, app, session_id=None):
+        super().__init__()
+        self.app = app
+        self.cookies = {}
+        self.token = session_id
+
+
+class RedisSession(redis.Session):
+    pass
+
+
+class CookieSession(cookie.Session):
+    pass
+
+
+class CachedSession(redis.Session):
+    cache_size = 16
+    cache_ttl = 60
+
+
+class NotifiedSession(CachedSession):
+    cache_notify = True
+
+
+class LazySession(redis.Session):
+    lazy = True
+
+
+class SharedSession(redis.Session):
+    single_flight = True
+
+
+@pytest.fixture
+def app(loop, redis_server):
+    import sanic
+    from cryptography.fernet import Fernet
+    from pie.redis.aioredis import init_app
+
+    rv = sanic.Sanic('test_session')
+    rv.config.REDIS_PORT = redis_server.port
+    rv.config.SESSION_COOKIE_KEYS = [Fernet.generate_key()]
+    init_app(rv)
+    rv.is_running = True
+    loop.run_until_complete(start_app(rv, loop))
+    yield rv
+    loop.run_until_complete(stop_app(rv, loop))
+
+
+async def create(app, cls, **values):
+    session = await cls(Request(app))
+    for key, value in values.items():
+        session.set(key, value)
+    return await session.save()
+
+
+async def load(app, cls, session_id, keys=()):
+    session = cls.of(Request(app, session_id), keys=keys)
+    return await session
+
+
+def count_fetches(monkeypatch, cls):
+    rv = []
+    fetch = cls._fetch_remote
+
+    async def wrapper(self, selector):
+        rv.append(selector)
+        return await fetch(self, selector)
+
+    monkeypatch.setattr(cls, '_fetch_remote', wrapper)
+    return rv
+
+
+async def update(app, session_id, **values):
+    # written by another worker, bypassing this worker's cache
+    session = await load(app, RedisSession, session_id)
+    for key, value in values.items():
+        session.set(key, value)
+    await session.save()
+
+
+def test_cache_verifies_nonce(app, loop, monkeypatch):
+    fetches = count_fetches(monkeypatch, CachedSession)
+
+    async def run():
+        session_id = await create(app, RedisSession, uid=1)
+        assert (await load(app, CachedSession, session_id)).get('uid') == 1
+        assert (await load(app, CachedSession, session_id)).get('uid') == 1
+        assert len(fetches) == 1
+        await update(app, session_id, uid=2)
+        assert (await load(app, CachedSession, session_id)).get('uid') == 2
+        assert len(fetches) == 2
+
+    loop.run_until_complete(run())
+
+
+def test_cache_notify(app, loop, monkeypatch):
+    fetches = count_fetches(monkeypatch, NotifiedSession)
+
+    async def run():
+        await app.redis.config_set('notify-keyspace-events', 'Kghx')
+        task = loop.create_task(NotifiedSession._listen(app))
+        try:
+            while not NotifiedSession._cache_notified:
+                await asyncio.sleep(0.01)
+            session_id = await create(app, RedisSession, uid=1)
+            for _ in range(3):
+                session = await load(app, NotifiedSession, session_id)
+                assert session.get('uid') == 1
+            assert len(fetches) == 1
+            await update(app, session_id, uid=2)
+            await asyncio.sleep(0.1)
+            session = await load(app, NotifiedSession, session_id)
+            assert session.get('uid') == 2
+        finally:
+            task.cancel()
+            await asyncio.wait([task])
+
+    loop.run_until_complete(run())
+
+
+def test_lazy_load(app, loop):
+    async def run():
+        session_id = await create(app, RedisSession, uid=1, name='pie',
+                                  big='x' * 4096)
+        session = await load(app, LazySession, session_id, keys=['name'])
+        # preloaded keys and the index key come with the first read
+        assert session.get('name') == 'pie'
+        assert session.get('uid') == 1
+        with pytest.raises(AssertionError):
+            session.get('big')
+        await session.fetch('big')
+        assert session.get('big') == 'x' * 4096
+
+        # a pending key set before it is fetched is not overwritten
+        session = await load(app, LazySession, session_id)
+        session.set('big', 'y')
+        await session.fetch('big')
+        assert session.get('big') == 'y'
+        await session.save()
+        session = await load(app, LazySession, session_id, keys=['big'])
+        assert session.get('big') == 'y'
+        assert session._pending == {'name'}
+
+    loop.run_until_complete(run())
+
+
+def test_single_flight(app, loop, monkeypatch):
+    fetches = count_fetches(monkeypatch, SharedSession)
+
+    async def run():
+        session_id = await create(app, RedisSession, uid=1,
+                                  profile={'name': 'pie'})
+        sessions = await asyncio.gather(*[
+            load(app, SharedSession, session_id) for _ in range(5)])
+        assert len(fetches) == 1
+        # every request gets its own copy of the shared result
+        sessions[0].get('profile')['name'] = 'changed'
+        assert sessions[1].get('profile') == {'name': 'pie'}
+
+        # the shared read is dropped once it completes
+        await load(app, SharedSession, session_id)
+        assert len(fetches) == 2
+
+    loop.run_until_complete(run())
+
+
+def test_revoke_all(app, loop):
+    async def run():
+        revoked = [await create(app, RedisSession, uid=1) for _ in range(3)]
+        kept = await create(app, RedisSession, uid=2)
+        assert await RedisSession.revoke_all(app, 1, batch=1) == 3
+        for session_id in revoked:
+            assert (await load(app, RedisSession, session_id)).get(
+                'uid') is None
+        assert (await load(app, RedisSession, kept)).get('uid') == 2
+        assert not await app.redis.exists(RedisSession._index_name(1))
+
+    loop.run_until_complete(run())
+
+
+def test_revoke_all_cookies(app, loop, monkeypatch):
+    async def run():
+        revoked = await create(app, CookieSession, uid=1)
+        await CookieSession.revoke_all(app, 1)
+        kept = await create(app, CookieSession, uid=1)
+
+        # cookies are trusted until their next check is due
+        assert (await load(app, CookieSession, revoked)).get('uid') == 1
+        monkeypatch.setattr(CookieSession, 'revoke_check_interval', 0)
+        assert (await load(app, CookieSession, revoked)).get('uid') is None
+        assert (await load(app, CookieSession, kept)).get('uid') == 1
+
+    loop.run_until_complete(run())
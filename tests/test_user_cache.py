@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from .conftest import start_app, stop_app
+
+
+class Transaction:
+    def __await__(self):
+        return self._begin().__await__()
+
+    async def _begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class Engine:
+    def transaction(self):
+        return Transaction()
+
+
+def make_cache(redis_server, monkeypatch):
+    import sanic
+    from pie.auth import models
+    from pie.auth.cache import UserCache
+    from pie.redis.aioredis import init_app
+
+    app = sanic.Sanic('test_user_cache')
+    app.config.update(REDIS_PORT=redis_server.port)
+    init_app(app)
+    cache = UserCache(app)
+    monkeypatch.setattr(models, 'user_hooks', [cache.invalidate])
+    return app, cache
+
+
+def run(loop, app, m):
+    async def wrapper():
+        await start_app(app, loop)
+        try:
+            await m()
+        finally:
+            await stop_app(app, loop)
+    loop.run_until_complete(wrapper())
+
+
+def test_invalidated_after_commit_only(loop, redis_server, monkeypatch):
+    from pie.auth.models import User, _user_changed
+    from pie.db import TransactionEngine
+    app, cache = make_cache(redis_server, monkeypatch)
+    engine = TransactionEngine(Engine())
+    user = User(id=1, email='pie@example.com', profile={})
+
+    async def cached():
+        return cache.peek(1) is not None and \
+            await app.redis.hget(cache._key(1), 'row') is not None and \
+            await app.redis.get(cache._email_key(user.email)) is not None
+
+    async def fill():
+        data = cache._dump(user)
+        cache._users.set(1, data)
+        await app.redis.hset(cache._key(1), 'row', data)
+        await app.redis.set(cache._email_key(user.email), '1')
+
+    async def m():
+        await fill()
+        tx = await engine.transaction()
+        await _user_changed(user, user.email)
+        await tx.rollback()
+        assert await cached()
+
+        try:
+            async with engine.transaction():
+                await _user_changed(user, user.email)
+                raise ValueError()
+        except ValueError:
+            pass
+        assert await cached()
+
+        async with engine.transaction():
+            await _user_changed(user, user.email)
+            # readers would cache the old row again before the commit
+            assert await cached()
+        assert cache.peek(1) is None
+        assert await app.redis.hget(cache._key(1), 'row') is None
+        assert await app.redis.get(cache._email_key(user.email)) is None
+
+        # outside a transaction the change is already visible
+        await fill()
+        await _user_changed(user, user.email)
+        assert cache.peek(1) is None
+
+    run(loop, app, m)
+
+
+class FakeCache:
+    def __init__(self):
+        self.batches = []
+
+    def peek(self, uid, default=None):
+        return default
+
+    async def get_many(self, ids):
+        self.batches.append(sorted(ids))
+        return {uid: f'user{uid}' for uid in ids if uid < 10}
+
+
+def test_loader_batches_concurrent_loads(loop):
+    login = pytest.importorskip('pie.auth.login')
+    cache = FakeCache()
+    loader = login.UserLoader(cache)
+
+    async def m():
+        rv = await asyncio.gather(*[loader.load(uid) for uid in (1, 2, 1, 42)])
+        assert rv == ['user1', 'user2', 'user1', None]
+        assert cache.batches == [[1, 2, 42]]
+        assert await loader.load(3) == 'user3'
+        assert cache.batches == [[1, 2, 42], [3]]
+
+    loop.run_until_complete(m())
@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+import pytest
+
+from pie.utils import (LRUCache, RetryBudget, TokenBucket, retry_attempts,
+                       retry_on)
+
+
+class Failure(Exception):
+    pass
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def flaky(failures, **kwargs):
+    calls = []
+
+    @retry_on(Failure, **kwargs)
+    async def m():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise Failure()
+        return len(calls)
+
+    return m, calls
+
+
+def test_retry_once_by_default():
+    m, calls = flaky(1)
+    assert run(m()) == 2
+
+    m, calls = flaky(2)
+    with pytest.raises(Failure):
+        run(m())
+    assert len(calls) == 2
+
+
+def test_other_errors_not_retried():
+    @retry_on(Failure, times=3)
+    async def m():
+        calls.append(None)
+        raise ValueError()
+
+    calls = []
+    with pytest.raises(ValueError):
+        run(m())
+    assert len(calls) == 1
+
+
+def test_backoff():
+    m, calls = flaky(3, times=4, backoff=0.01, jitter=False)
+    loop = asyncio.new_event_loop()
+    try:
+        start = loop.time()
+        assert loop.run_until_complete(m()) == 4
+        assert loop.time() - start >= 0.01 + 0.02 + 0.04
+    finally:
+        loop.close()
+
+
+def test_deadline():
+    m, calls = flaky(3, times=4, backoff=0.05, jitter=False, deadline=0.1)
+    with pytest.raises(Failure):
+        run(m())
+    assert len(calls) == 2
+
+
+def test_budget():
+    budget = RetryBudget(ratio=0.5, max_retries=1)
+    m, calls = flaky(10, times=3, budget=budget)
+    with pytest.raises(Failure):
+        run(m())
+    # one retry from the initial balance, none left for the second one
+    assert len(calls) == 2
+
+    calls.clear()
+    with pytest.raises(Failure):
+        run(m())
+    assert len(calls) == 1
+
+
+def test_attempts_counted():
+    m, calls = flaky(2, times=3)
+    before = sum(retry_attempts.values())
+    assert run(m()) == 3
+    assert sum(retry_attempts.values()) - before == 2
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # 'b' was the least recently used
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(ttl=1)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=5)
+    now[0] += 2
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.get('b') == 2
+    now[0] += 4
+    assert 'b' not in cache
+
+
+def test_lru_pop_and_falsy_values():
+    cache = LRUCache()
+    cache.set('none', None)
+    assert 'none' in cache
+    assert cache.get('none', 'missing') is None
+    assert cache.pop('none', 'missing') is None
+    assert cache.pop('none', 'missing') == 'missing'
+    cache.set('a', 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_token_bucket_slow_rate():
+    bucket = TokenBucket(0.5)
+    assert bucket.capacity == 1
+    run(asyncio.wait_for(bucket.acquire(), 1))
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(100, capacity=2)
+    loop = asyncio.new_event_loop()
+    try:
+        start = loop.time()
+        for _ in range(4):
+            loop.run_until_complete(bucket.acquire())
+        # two from the burst, two refilled at 100/s
+        assert loop.time() - start >= 0.015
+    finally:
+        loop.close()
+
+
+def test_token_bucket_rejects_impossible_requests():
+    with pytest.raises(ValueError):
+        run(TokenBucket(5, capacity=2).acquire(3))
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+    with pytest.raises(ValueError):
+        TokenBucket(1, capacity=0)